@@ -0,0 +1,116 @@
+from decimal import ROUND_DOWN, Decimal
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from portfolio import Product
+
+
+def truncate_to_increment(value: float, increment: Decimal) -> float:
+    """Largest multiple of the increment not above value, computed exactly on the decimal value."""
+    if increment <= 0:
+        return value
+    return float((Decimal(repr(float(value))) / increment).to_integral_value(ROUND_DOWN) * increment)
+
+
+class ProductConstraints:
+    """Order constraints of a product, parsed once from the exchange product data."""
+
+    def __init__(self, min_funds: Decimal, quote_increment: Decimal, source=None):
+        self.min_funds = min_funds
+        self.quote_increment = quote_increment
+        # raw exchange values parsed, to notice a refreshed listing changed them
+        self.source = source
+        # float copy for the comparisons done in the allocation loop
+        self.min_funds_value = float(min_funds)
+
+    def truncate(self, value: float) -> float:
+        return truncate_to_increment(value, self.quote_increment)
+
+    @staticmethod
+    def build(product_data: Dict) -> 'ProductConstraints':
+        source = ProductConstraints.source_of(product_data)
+        return ProductConstraints(Decimal(source[0]), Decimal(source[1]), source)
+
+    @staticmethod
+    def source_of(product_data: Dict) -> Tuple[str, str]:
+        return str(product_data['min_market_funds']), str(product_data['quote_increment'])
+
+
+def build_constraints(tradable_products: Dict[Product, Dict]) -> Dict[Product, ProductConstraints]:
+    return {p: ProductConstraints.build(data) for p, data in tradable_products.items()}
+
+
+class Allocation:
+    def __init__(self, orders: Dict[Product, float], dropped: List[Product], leftover: float):
+        self.orders = orders
+        # products whose share was below their minimum and went to the next product
+        self.dropped = dropped
+        # part of the amount that couldn't be allocated (truncation dust, nothing reaching a minimum)
+        self.leftover = leftover
+
+
+def allocate(weights: Dict[Product, float], amount, constraints: Dict[Product, ProductConstraints]) -> Allocation:
+    """Split amount proportionally to the weights in one pass.
+
+    A share below the product minimum is carried over to the next product (in weights order),
+    what is still carried after the last product goes to the first product kept.
+    """
+    ratio = sum(abs(v) for v in weights.values())
+    if len(weights) == 0 or ratio == 0:
+        return Allocation({}, list(weights), float(amount))
+
+    kept = {}
+    dropped = []
+    carry = 0.0
+    for p, w in weights.items():
+        value = abs(amount * (w / ratio * 100.0) / 100.0) + carry
+        if value < constraints[p].min_funds_value:
+            dropped.append(p)
+            carry = value
+        else:
+            kept[p] = value
+            carry = 0.0
+    if carry > 0 and len(kept) > 0:
+        first = next(iter(kept))
+        kept[first] += carry
+
+    orders = {p: constraints[p].truncate(v) for p, v in kept.items()}
+    return Allocation(orders, dropped, amount - sum(orders.values()))
+
+
+def allocate_batch(selected: np.ndarray, weights: np.ndarray, amount, min_funds: np.ndarray, increments: List[Decimal]):
+    """`allocate` for many periods at once.
+
+    `selected` holds product indexes (selections x periods, in ranking order, -1 padded) and
+    `weights` the matching weights. Returns the funds and bought mask (same shape) and the
+    leftover of every period.
+    """
+    rows, periods = selected.shape
+    active = selected >= 0
+    idx = np.where(active, selected, 0)
+    weights = np.where(active, weights, 0.0)
+    # cumulative sum so the ratio is added up in the same order as sum()
+    ratio = np.cumsum(np.abs(weights), axis=0)[-1] if rows > 0 else np.zeros(periods)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        funds = np.abs(amount * (weights / ratio * 100.0) / 100.0)
+    funds = np.where(active & (ratio > 0), funds, 0.0)
+
+    mins = min_funds[idx]
+    carry = np.zeros(periods)
+    kept = np.zeros_like(active)
+    for j in range(rows):
+        value = funds[j] + carry
+        keep = active[j] & (value >= mins[j])
+        drop = active[j] & ~keep
+        funds[j] = np.where(keep, value, 0.0)
+        kept[j] = keep
+        carry = np.where(drop, value, np.where(keep, 0.0, carry))
+    first_kept = np.argmax(kept, axis=0)
+    cols = np.flatnonzero(kept.any(axis=0) & (carry > 0))
+    funds[first_kept[cols], cols] += carry[cols]
+
+    for j, k in zip(*np.nonzero(kept)):
+        funds[j, k] = truncate_to_increment(funds[j, k], increments[idx[j, k]])
+    leftover = amount - np.cumsum(funds, axis=0)[-1] if rows > 0 else np.full(periods, float(amount))
+    return funds, kept, leftover
@@ -0,0 +1,207 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from allocation import allocate_batch, build_constraints
+from portfolio import Portfolio, Product
+from tickers import CLOSE, VOLUME, TickerStore, day_index, day_to_datetime
+from trading import Strategy, next_mixed_strategy
+
+
+class BacktestResult:
+    """Orders and holdings of a vectorized backtest, kept as arrays."""
+
+    def __init__(self, products: List[Product], end_days: np.ndarray, order_period: np.ndarray, order_product: np.ndarray,
+                 order_funds: np.ndarray, order_price: np.ndarray, today_close: np.ndarray):
+        self.products = products
+        self.end_days = end_days
+        self.order_period = order_period
+        self.order_product = order_product
+        self.order_funds = order_funds
+        self.order_price = order_price
+        self.quantity = np.zeros(len(products))
+        np.add.at(self.quantity, order_product, order_funds * order_price)
+        # sums are accumulated sequentially, in the same order as Portfolio does
+        self.spent = float(np.cumsum(order_funds)[-1]) if len(order_funds) > 0 else 0.0
+        _, first = np.unique(order_product, return_index=True)
+        held = order_product[np.sort(first)]
+        values = self.quantity[held] * today_close[held]
+        self.total = float(np.cumsum(values)[-1]) if len(values) > 0 else 0.0
+        self.gain = self.total / self.spent * 100.0 if self.spent > 0 else 0.0
+
+    def to_portfolio(self, base_currency) -> Portfolio:
+        portfolio = Portfolio(base_currency)
+        for k, p, funds, price in zip(self.order_period, self.order_product, self.order_funds, self.order_price):
+            portfolio.buy(self.products[p], day_to_datetime(int(self.end_days[k])), float(funds), float(price))
+        return portfolio
+
+
+class VectorizedBacktest:
+    """Array based equivalent of `TradingEngine.simulate_period` over already prepared candles."""
+
+    def __init__(self, tickers: TickerStore, tradable_products: Dict[Product, Dict], buy_amount):
+        self.tickers = tickers
+        self.products = list(tradable_products)
+        self.product_ids = [p.id for p in self.products]
+        self.buy_amount = buy_amount
+        constraints = build_constraints(tradable_products)
+        self.min_funds = np.array([constraints[p].min_funds_value for p in self.products])
+        self.increments = [constraints[p].quote_increment for p in self.products]
+        # (first day, last day, field -> products x days) set by preload
+        self.loaded = None
+
+    def boundaries(self, interval, periods, today=None) -> np.ndarray:
+        """Period boundary days, period k goes from boundary k to boundary k + 1."""
+        today = day_index(today if today is not None else datetime.now())
+        return today - np.arange(periods, -1, -1) * interval
+
+    def scores(self, strategy: Strategy, close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+        """Products x periods trends, NaN when a boundary candle is missing."""
+        if strategy in (Strategy.TopVolume, Strategy.LessVolume):
+            return (volume[:, 1:] - volume[:, :-1]) / volume[:, 1:] * 100.0
+        elif strategy in (Strategy.TopGainers, Strategy.TopLosers):
+            return (close[:, 1:] - close[:, :-1]) / close[:, 1:] * 100.0
+        raise ValueError(
+            f"Strategy {strategy.name} is not supported by the vectorized backtest")
+
+    def select(self, strategy: Strategy, scores: np.ndarray, limit_products) -> np.ndarray:
+        """Ranked product indexes per period (selections x periods), -1 padded."""
+        valid = ~np.isnan(scores)
+        key = -scores if strategy in (Strategy.TopGainers, Strategy.TopVolume) else scores
+        key = np.where(valid, key, np.inf)
+        # stable, ties keep the tradable products order like sorted() does
+        order = np.argsort(key, axis=0, kind="stable")
+        counts = valid.sum(axis=0)
+        if limit_products > 0:
+            counts = np.minimum(counts, limit_products)
+        rows = int(counts.max()) if counts.size > 0 else 0
+        order = order[:rows]
+        return np.where(np.arange(rows)[:, None] < counts[None, :], order, -1)
+
+    def preload(self, first_day, last_day):
+        """Read once the close and volume matrices of many runs, the runs within them only slice them."""
+        self.loaded = (first_day, last_day,
+                       {field: self.tickers.matrix(self.product_ids, first_day, last_day, field) for field in (CLOSE, VOLUME)})
+
+    def matrix(self, first_day, last_day, field) -> np.ndarray:
+        if self.loaded is not None and self.loaded[0] <= first_day and last_day <= self.loaded[1]:
+            return self.loaded[2][field][:, first_day - self.loaded[0]:last_day - self.loaded[0] + 1]
+        return self.tickers.matrix(self.product_ids, first_day, last_day, field)
+
+    def run(self, strategy: Strategy, limit_products, interval, periods, today=None) -> BacktestResult:
+        bounds = self.boundaries(interval, periods, today)
+        close = self.matrix(int(bounds[0]), int(bounds[-1]), CLOSE)
+        volume = self.matrix(int(bounds[0]), int(bounds[-1]), VOLUME)
+        cols = bounds - bounds[0]
+        scores = self.scores(strategy, close[:, cols], volume[:, cols])
+
+        selected = self.select(strategy, scores, limit_products)
+        weights = scores[np.where(selected >= 0, selected, 0), np.arange(scores.shape[1])]
+        funds, kept, _ = allocate_batch(selected, weights, self.buy_amount,
+                                        self.min_funds, self.increments)
+
+        # orders are listed period after period, in selection order
+        bought = kept.T
+        order_period, _ = np.nonzero(bought)
+        order_product = selected.T[bought]
+        order_funds = funds.T[bought]
+        order_price = 1.0 / close[order_product, cols[order_period + 1]]
+        return BacktestResult(self.products, bounds[1:], order_period, order_product,
+                              order_funds, order_price, close[:, -1])
+
+
+# strategies the vectorized engine can rank from candles alone
+VECTORIZED_STRATEGIES = (Strategy.TopGainers, Strategy.TopLosers,
+                         Strategy.TopVolume, Strategy.LessVolume)
+
+
+def simulate_vectorized(trading, trading_interval_days: int, periods: int, tradable_products=None) -> float:
+    """Vectorized `TradingEngine.simulate_period`, fills `trading.portfolio` and returns the gain."""
+    if trading.strategy not in VECTORIZED_STRATEGIES:
+        # market cap and mixed strategies need more than candles, like tune they use the loop engine
+        print(f"Strategy {trading.strategy.name} is not supported by the vectorized backtest, using the loop engine")
+        return trading.simulate_period(trading_interval_days, periods, tradable_products)
+    if trading.buy_time is not None:
+        # daily candles only, orders bought at a time of the day need the intraday ones
+        print("Buying at a given hour is not supported by the vectorized backtest, using the loop engine")
+        return trading.simulate_period(trading_interval_days, periods, tradable_products)
+    if tradable_products is None:
+        tradable_products = trading.prepare_simulation(
+            trading_interval_days, periods)
+
+    result = VectorizedBacktest(trading.tickers, tradable_products, trading.buy_amount).run(
+        trading.strategy, trading.limit_products, trading_interval_days, periods)
+    trading.portfolio = result.to_portfolio(trading.base_currency)
+    print(trading.portfolio.summary(trading.tickers))
+    print(
+        f"Strategy used: {trading.strategy.name} across last {periods} periods of {trading_interval_days} days each")
+    return trading.portfolio.gain
+
+
+def rank_products(strategy: Strategy, gains: np.ndarray, volumes: np.ndarray, limit_products) -> np.ndarray:
+    """Product indexes selected by a candle based strategy, ranked like `get_last_market_trends`."""
+    scores = volumes if strategy in (Strategy.TopVolume, Strategy.LessVolume) else gains
+    valid = np.flatnonzero(~np.isnan(scores))
+    key = -scores[valid] if strategy in (Strategy.TopGainers, Strategy.TopVolume) else scores[valid]
+    # stable, ties keep the tradable products order like sorted() does
+    ranked = valid[np.argsort(key, kind="stable")]
+    return ranked[:limit_products] if limit_products > 0 else ranked
+
+
+def buy_time_trends(trading, products: List[Product], start: datetime, end: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """Gains and volume changes like the TrendIndex ones, from what is known at the buy time of start and end."""
+    gains = np.full(len(products), np.nan)
+    volumes = np.full(len(products), np.nan)
+    for i, product in enumerate(products):
+        old = trading.trend_candle(product.id, start)
+        now = trading.trend_candle(product.id, end)
+        if old is not None and now is not None:
+            gains[i] = (now[0] - old[0]) / now[0] * 100.0
+            volumes[i] = (now[1] - old[1]) / now[1] * 100.0
+    return gains, volumes
+
+
+def simulate_strategies(trading, trading_interval_days: int, periods: int, strategies: List[Strategy],
+                        tradable_products=None) -> Dict[Strategy, Portfolio]:
+    """Portfolios of separate `simulate_period` runs of every strategy, simulated in a single pass.
+
+    Gains and volume changes of all the products are computed once per period for all the
+    strategies, the mixed rotation is kept in memory.
+    """
+    if tradable_products is None:
+        tradable_products = trading.prepare_simulation(
+            trading_interval_days, periods)
+    products = list(tradable_products)
+
+    starts = []
+    for p in range(periods, 0, -1):
+        start = datetime.now() - timedelta(days=p*trading_interval_days)
+        starts.append(start.replace(hour=0, minute=0, second=0, microsecond=0))
+    index = trading.trend_index(products, starts[0], starts[-1] + timedelta(days=trading_interval_days))
+
+    portfolios = {strategy: Portfolio(trading.base_currency) for strategy in strategies}
+    last_mixed = None
+    for start in starts:
+        end = start + timedelta(days=trading_interval_days)
+        if trading.buy_time is not None and trading.pyramid is not None:
+            gains, volumes = buy_time_trends(trading, products, start, end)
+        else:
+            gains = index.gain(day_index(start), day_index(end))
+            volumes = index.volume_change(day_index(start), day_index(end))
+        if Strategy.Mixed in portfolios:
+            last_mixed = next_mixed_strategy(last_mixed)
+
+        for strategy, portfolio in portfolios.items():
+            concrete = last_mixed if strategy == Strategy.Mixed else strategy
+            if concrete == Strategy.TopMarketCap:
+                trends = trading.get_market_cap_trends(tradable_products, end)
+            else:
+                scores = volumes if concrete in (Strategy.TopVolume, Strategy.LessVolume) else gains
+                trends = {products[i]: float(scores[i])
+                          for i in rank_products(concrete, gains, volumes, trading.limit_products)}
+            ordering_products = trading.get_buy_quotes(trends, tradable_products)
+            for product, funds in ordering_products.items():
+                buy_date, price = trading.buy_price(product.id, end)
+                portfolio.buy(product, buy_date, funds, 1.0 / price)
+    return portfolios
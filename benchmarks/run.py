@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Benchmarks.
+
+Usage:
+  run.py [--products=<products>] [--years=<years>] [--latency=<seconds>] [--repeat=<repeat>] [--interval=<interval>] [--output=<file>] [--compare=<file>]
+  run.py (-h | --help)
+
+Options:
+  -h --help                 Show this screen.
+  --products=<products>     Comma separated product counts [default: 10,100,1000]
+  --years=<years>           Comma separated history lengths in years [default: 1,5,10]
+  --latency=<seconds>       Synthetic api latency per request [default: 0]
+  --repeat=<repeat>         Runs per benchmark, the best one is reported [default: 3]
+  --interval=<interval>     Trading interval in days [default: 7]
+  --output=<file>           Write the results as json to this file
+  --compare=<file>          Json results of a previous run to compare with
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docopt import docopt  # noqa: E402
+from rich.console import Console  # noqa: E402
+
+import gui  # noqa: E402
+from synthetic import SyntheticExchange  # noqa: E402
+from trading import Strategy, TradingEngine  # noqa: E402
+
+# no throttling, the synthetic exchange has no rate limit
+KEY_DATA = {'type': "synthetic", 'key': "", 'ws_url': "",
+            'public_rate': 1e9, 'public_burst': 1e9, 'fetch_workers': 4}
+BASE_CURRENCY = "EUR"
+
+
+def timed(repeat, func, setup=None):
+    """Best and all durations of `repeat` calls, setup (untimed) runs before each call."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func(arg) if setup is not None else func()
+            durations.append(time.perf_counter() - start)
+    return min(durations), durations, result
+
+
+def engine(exchange, strategy=Strategy.TopGainers, limit=10):
+    trading = TradingEngine(KEY_DATA, BASE_CURRENCY, 50,
+                            strategy, limit, exchange=exchange)
+    trading.strategy_file = None
+    return trading
+
+
+def bench_scale(products, years, latency, repeat, interval):
+    days = years * 365
+    exchange = SyntheticExchange(products, days, latency=latency)
+    tradable_products = exchange.get_tradable_products(BASE_CURRENCY)
+    begin = datetime.today() - timedelta(days=days - 1)
+    end = datetime.today()
+    results = {}
+
+    def fresh_cache(_=None):
+        shutil.rmtree("cache", ignore_errors=True)
+        return engine(exchange)
+
+    best, runs, _ = timed(repeat, lambda t: t.prepare_data(tradable_products, begin, end), fresh_cache)
+    results['prepare_data.cold'] = (best, runs)
+    best, runs, trading = timed(repeat, lambda t: (t.prepare_data(tradable_products, begin, end), t)[1],
+                                lambda _=None: engine(exchange))
+    results['prepare_data.warm'] = (best, runs)
+
+    start = (end - timedelta(days=interval)).replace(hour=0, minute=0, second=0, microsecond=0)
+    trend_end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    best, runs, trends = timed(repeat, lambda: trading.get_last_market_trends(tradable_products, start, trend_end))
+    results['get_last_market_trends'] = (best, runs)
+    best, runs, _ = timed(repeat, lambda: trading.get_buy_quotes(trends, tradable_products))
+    results['get_buy_quotes'] = (best, runs)
+
+    periods = max(1, (days - 1) // interval)
+
+    def simulation(_=None):
+        t = engine(exchange)
+        t.tickers = trading.tickers
+        return t
+
+    best, runs, simulated = timed(repeat, lambda t: (t.simulate_period(interval, periods, tradable_products), t)[1],
+                                  simulation)
+    results['simulate_period'] = (best, runs)
+    portfolio = simulated.portfolio
+    best, runs, _ = timed(repeat, lambda: portfolio.summary(trading.tickers))
+    results['portfolio.summary'] = (best, runs)
+
+    console = Console(file=io.StringIO(), width=160)
+    renderers = {
+        'gui.make_summary': lambda: gui.make_summary(portfolio, trading.tickers, BASE_CURRENCY),
+        'gui.make_portfolio': lambda: gui.make_portfolio(portfolio, trading.tickers),
+        'gui.make_gain': lambda: gui.make_gain(portfolio, trading.tickers),
+        'gui.make_order_grid': lambda: gui.make_order_grid(portfolio.orders),
+    }
+    for name, make in renderers.items():
+        best, runs, _ = timed(repeat, lambda: console.print(make()))
+        results[name] = (best, runs)
+
+    return [{'products': products, 'years': years, 'latency': latency, 'benchmark': name,
+             'seconds': best, 'runs': runs} for name, (best, runs) in results.items()]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = {(r['products'], r['years'], r['benchmark']): r['seconds']
+                    for r in json.load(f)['results']}
+    for r in results:
+        before = baseline.get((r['products'], r['years'], r['benchmark']))
+        if before:
+            print(f"{r['products']:>5} x {r['years']:>2}y {r['benchmark']:<24} {before:>10.4f}s -> {r['seconds']:>10.4f}s ({r['seconds'] / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    latency = float(arguments["--latency"])
+    repeat = int(arguments["--repeat"])
+    interval = int(arguments["--interval"])
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="cbportfolio-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for products in [int(p) for p in arguments["--products"].split(",")]:
+            for years in [int(y) for y in arguments["--years"].split(",")]:
+                scale = bench_scale(products, years, latency, repeat, interval)
+                for r in scale:
+                    print(f"{products:>5} x {years:>2}y {r['benchmark']:<24} {r['seconds']:>10.4f}s", file=sys.stderr)
+                results.extend(scale)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if arguments["--output"]:
+        with open(arguments["--output"], "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if arguments["--compare"]:
+        compare(results, arguments["--compare"])
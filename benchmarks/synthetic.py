@@ -0,0 +1,105 @@
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict
+
+import numpy as np
+
+from portfolio import Product
+
+
+class SyntheticExchange:
+    """Exchange generating deterministic random walk candles for N products over M days.
+
+    The same products, days and seed always give the same candles. `latency` seconds are
+    slept on every historical request to mimic the exchange api, and the first `rate_limited`
+    historical requests are answered like a 429 of the coinbase public api.
+
+    `order_failures` are used up by the next order placements, one each: "error" (5xx, order not
+    placed), "lost" (timeout, not placed), "accepted_error" (5xx after placing it) or
+    "accepted_timeout" (timeout after placing it), None places it normally. Placed orders are
+    found again by client_oid.
+    """
+
+    def __init__(self, products=100, days=365, seed=0, latency=0.0, base_currency="EUR", today=None,
+                 rate_limited=0, order_failures=()):
+        self.products = products
+        self.days = days
+        self.seed = seed
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.order_failures = list(order_failures)
+        self.base_currency = base_currency
+        today = today if today is not None else datetime.now()
+        self.last = today.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.first = self.last - timedelta(days=days - 1)
+        self.requests = 0
+        self.orders = 0
+        self.lock = threading.Lock()
+        self.placed: Dict[str, Dict] = {}
+        self._candles: Dict[str, np.ndarray] = {}
+
+    def product_ids(self):
+        return [f"S{i:04d}-{self.base_currency}" for i in range(self.products)]
+
+    def candles(self, product_id) -> np.ndarray:
+        """All the product candles, (days x 6) rows of [time, low, high, open, close, volume]."""
+        if product_id not in self._candles:
+            rng = np.random.default_rng([self.seed, zlib.crc32(product_id.encode())])
+            close = 10.0 ** rng.uniform(-2, 4) * np.exp(np.cumsum(rng.normal(0, 0.04, self.days)))
+            open_ = np.append(close[0], close[:-1])
+            spread = 1.0 + np.abs(rng.normal(0, 0.02, (2, self.days)))
+            start = int(self.first.timestamp())
+            self._candles[product_id] = np.column_stack([
+                start + np.arange(self.days) * 86400,
+                np.minimum(open_, close) / spread[0],
+                np.maximum(open_, close) * spread[1],
+                open_,
+                close,
+                rng.lognormal(8, 1, self.days),
+            ])
+        return self._candles[product_id]
+
+    def get_tradable_products(self, base_currency) -> Dict[Product, Dict]:
+        return {Product.build(pid): {'id': pid, 'quote_currency': base_currency, 'min_market_funds': "1",
+                                     'quote_increment': "0.01"} for pid in self.product_ids()}
+
+    def get_historical(self, product_id, begin, end, granularity=86400):
+        with self.lock:
+            self.requests += 1
+            limited = self.requests <= self.rate_limited
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if limited:
+            return {'message': "Public rate limit exceeded"}
+        candles = self.candles(product_id)
+        selected = candles[(candles[:, 0] >= begin.timestamp()) & (candles[:, 0] <= end.timestamp())]
+        # newest first, as lists, like the coinbase api
+        return selected[::-1].tolist()
+
+    def get_account(self, base_currency):
+        return {'currency': base_currency, 'balance': "1000000"}
+
+    def place_market_order(self, product_id, quote_amount, client_oid=None):
+        with self.lock:
+            self.orders += 1
+            failure = self.order_failures.pop(0) if len(self.order_failures) > 0 else None
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if failure == "error":
+            return {'message': "Internal server error"}
+        if failure == "lost":
+            raise TimeoutError("read timed out")
+        order = {'id': client_oid or str(self.orders), 'product_id': product_id, 'funds': quote_amount}
+        with self.lock:
+            self.placed[order['id']] = order
+        if failure == "accepted_error":
+            return {'message': "Internal server error"}
+        if failure == "accepted_timeout":
+            raise TimeoutError("read timed out")
+        return order
+
+    def find_order(self, client_oid):
+        with self.lock:
+            return self.placed.get(client_oid)
@@ -0,0 +1,195 @@
+import json
+import os
+import struct
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from filelock import atomic_write, lock_file, locked
+from tickers import DAY, FIELDS, GRANULARITIES, TickerStore
+
+# file header: magic, format version, committed record count, first and last day stored
+HEADER = struct.Struct("<4sIqqq")
+MAGIC = b"CBPC"
+VERSION = 2
+
+# the fetch time tells whether the candle was taken before its day was over
+RECORD = np.dtype([('day', '<i8')] + [(f, '<f8') for f in FIELDS] + [('fetched', '<f8')])
+
+
+class CandleCache:
+    """Per-product append-only binary candle files, read back through mmap.
+
+    Several processes can share the cache: appends take an exclusive file lock and are
+    committed by the header count written last, readers never lock and only read up to the
+    committed count, so they never see a partial append.
+    """
+
+    def __init__(self, directory="cache", legacy_file="cache.json", refresh_after=3600, granularity=DAY):
+        self.directory = directory
+        # daily files keep the plain name, finer candles get the granularity in it (BTC-EUR.1h.bin)
+        self.granularity = granularity
+        self.suffix = "" if granularity == DAY else "." + next(
+            name for name, g in GRANULARITIES.items() if g == granularity)
+        self.legacy_file = legacy_file
+        # candles of days not over yet when fetched are refreshed once older than this (seconds)
+        self.refresh_after = refresh_after
+        self.stale: Dict[str, List[int]] = {}
+        # product -> (store, record count, first day, last day, [(day, fetched)] of the last two days)
+        # of the last load, a store already holding the range doesn't read the file again
+        self.loaded: Dict[str, Tuple] = {}
+        # the legacy cache is looked at once per process
+        self.migrated = False
+
+    def path(self, product_id) -> str:
+        return os.path.join(self.directory, f"{product_id}{self.suffix}.bin")
+
+    def read_header(self, product_id):
+        path = self.path(product_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return self.parse_header(f.read(HEADER.size), path)
+
+    @staticmethod
+    def parse_header(data: bytes, path):
+        if len(data) < HEADER.size:
+            return None
+        magic, version, count, first, last = HEADER.unpack(data)
+        if magic != MAGIC or version != VERSION:
+            print(f"Ignoring cache file with unknown format {path}")
+            return None
+        return count, first, last
+
+    def records(self, product_id) -> np.ndarray:
+        header = self.read_header(product_id)
+        if header is None or header[0] == 0:
+            return np.empty(0, dtype=RECORD)
+        return np.memmap(self.path(product_id), dtype=RECORD, mode="r",
+                         offset=HEADER.size, shape=(header[0],))
+
+    def load(self, store: TickerStore, product_ids: Iterable[str], first_day: int, last_day: int) -> int:
+        """Load the cached candles of the given products between first and last day (inclusive)."""
+        self.migrate()
+        loaded = 0
+        for pid in product_ids:
+            self.stale.pop(pid, None)
+            header = self.read_header(pid)
+            if header is None or header[0] == 0 or header[2] < first_day or header[1] > last_day:
+                continue
+            previous = self.loaded.get(pid)
+            if previous is not None and previous[0] is store and previous[1] == header[0] \
+                    and previous[2] <= first_day and last_day <= previous[3]:
+                latest = previous[4]
+            else:
+                records = self.records(pid)
+                days = records['day']
+                mask = (days >= first_day) & (days <= last_day)
+                if not mask.any():
+                    continue
+                selected = records[mask]
+                # later records override earlier ones for the same day
+                _, last_idx = np.unique(selected['day'][::-1], return_index=True)
+                selected = selected[::-1][last_idx]
+                rows = np.column_stack([selected[f] for f in FIELDS])
+                store.put(pid, np.asarray(selected['day'], dtype=np.int64), rows)
+                loaded += len(selected)
+                latest = [(int(r['day']), float(r['fetched'])) for r in selected[-2:]]
+                self.loaded[pid] = (store, header[0], first_day, last_day, latest)
+
+            stale = []
+            now = time.time()
+            for day, fetched in latest:
+                day_end = store.to_datetime(day + 1).timestamp()
+                if fetched < day_end and fetched < now - self.refresh_after:
+                    stale.append(day)
+            if len(stale) > 0:
+                self.stale[pid] = stale
+        return loaded
+
+    def append(self, product_id, store: TickerStore, days: Iterable[int], fetched=None):
+        """Append the store candles of the given days to the product file."""
+        days = [int(d) for d in days if store.has(product_id, int(d))]
+        if len(days) == 0:
+            return
+        rows = np.array([store.candle(product_id, day) for day in days])
+        records = np.empty(len(days), dtype=RECORD)
+        records['day'] = days
+        for i, f in enumerate(FIELDS):
+            records[f] = rows[:, i]
+        records['fetched'] = fetched if fetched is not None else time.time()
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.path(product_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with locked(fd), os.fdopen(os.dup(fd), "r+b") as f:
+                # the header read under the lock, another process may have appended meanwhile
+                header = self.parse_header(f.read(HEADER.size), self.path(product_id))
+                if header is None:
+                    count, first, last = 0, min(days), max(days)
+                else:
+                    count, first, last = header
+                    first, last = min(first, min(days)), max(last, max(days))
+                # records past the committed count are leftovers of an interrupted append
+                f.seek(HEADER.size + count * RECORD.itemsize)
+                f.write(records.tobytes())
+                f.truncate()
+                f.flush()
+                # records on disk before the header committing them, even after a power loss
+                os.fsync(f.fileno())
+                # the new header commits the records, readers only go up to its count
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, VERSION, count + len(records), first, last))
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            os.close(fd)
+
+        previous = self.loaded.get(product_id)
+        if previous is not None and previous[0] is store and previous[1] == count:
+            # the store already has these candles, keep it in sync with the file
+            latest = dict(previous[4])
+            latest.update((day, float(records['fetched'][0])) for day in days)
+            self.loaded[product_id] = (store, count + len(records), min(previous[2], min(days)),
+                                       max(previous[3], max(days)), sorted(latest.items())[-2:])
+
+    def empty_path(self) -> str:
+        return os.path.join(self.directory, f"empty{self.suffix}.json")
+
+    def load_empty(self) -> Dict[str, List[List[int]]]:
+        path = self.empty_path()
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.loads(f.read())
+
+    def save_empty(self, empty: Dict[str, List[List[int]]]):
+        # merged with the ranges other processes saved meanwhile, the given products win
+        with lock_file(self.empty_path()):
+            merged = self.load_empty()
+            merged.update(empty)
+            atomic_write(self.empty_path(), json.dumps(merged))
+
+    def has_candles(self) -> bool:
+        """Whether any daily candle file exists, other files (metadata, empty ranges) don't count."""
+        if not os.path.isdir(self.directory):
+            return False
+        return any(name.endswith(".bin") and name.count(".") == 1 for name in os.listdir(self.directory))
+
+    def migrate(self):
+        """One-off import of the legacy json cache when no binary candle file exists yet."""
+        if self.migrated or self.legacy_file is None or self.granularity != DAY:
+            return
+        self.migrated = True
+        if not os.path.exists(self.legacy_file) or os.path.getsize(self.legacy_file) == 0:
+            return
+        # the cache directory may already hold metadata.json and the like, only candles tell it was migrated
+        with lock_file(os.path.join(self.directory, "migrate")):
+            if self.has_candles():
+                return
+            print(f"Migrating {self.legacy_file} to binary cache {self.directory}")
+            with open(self.legacy_file, "r") as f:
+                store = TickerStore.from_dict(json.loads(f.read()))
+            for pid in store.products():
+                self.append(pid, store, store.days(pid))
@@ -1,19 +1,26 @@
-import krakenex
-from pykrakenapi import KrakenAPI
-import cbpro
 from abc import ABC, abstractmethod
 
+from decimal import Decimal
 from typing import Dict, List
 
+import numpy as np
+
+from allocation import truncate_to_increment
 from portfolio import Product
 
+# client libraries of every exchange, imported only once that exchange gets built
+BACKENDS = {
+    "coinbase": ["cbpro"],
+    "kraken": ["krakenex"],
+}
+
 
 class Exchange(ABC):
     def __init__(self):
         pass
 
     @abstractmethod
-    def get_historical(self, product_id, begin, end):
+    def get_historical(self, product_id, begin, end, granularity=86400):
         pass
 
     @abstractmethod
@@ -21,13 +28,22 @@ class Exchange(ABC):
         pass
 
     @abstractmethod
-    def place_market_order(self, product_id, quote_amount) -> int:
+    def place_market_order(self, product_id, quote_amount, client_oid=None) -> int:
+        pass
+
+    @abstractmethod
+    def find_order(self, client_oid):
         pass
 
     @abstractmethod
     def get_tradable_products(self, base_currency) -> Dict[str, Dict]:
         pass
 
+    @abstractmethod
+    def get_markets(self, quote_currencies: List[str]) -> Dict[str, Dict[Product, Dict]]:
+        """Tradable products of every quote currency, from a single listing request."""
+        pass
+
     @staticmethod
     def build(data: Dict) -> 'Exchange':
         if data['type'] == "coinbase":
@@ -40,6 +56,7 @@ class Exchange(ABC):
 
 class CoinbaseExchange:
     def __init__(self, key_data):
+        import cbpro
         self.public_client = cbpro.PublicClient()
         key = key_data['key']
         if key is not None and key.strip() != "":
@@ -60,50 +77,181 @@ class CoinbaseExchange:
         return coinbase_account
 
     def get_tradable_products(self, base_currency) -> Dict[str, Dict]:
+        return self.get_markets([base_currency])[base_currency]
+
+    def get_markets(self, quote_currencies: List[str]) -> Dict[str, Dict[Product, Dict]]:
         products = self.public_client.get_products()
-        tradable_products = {}
+        markets = {currency: {} for currency in quote_currencies}
         for product in products:
-            if not product['trading_disabled'] and product['status'] == "online" and product['quote_currency'] == base_currency and not product['post_only'] and not product['limit_only'] and not product['cancel_only']:
-                tradable_products[Product.build(product['id'])] = product
-        return tradable_products
+            if not product['trading_disabled'] and product['status'] == "online" and product['quote_currency'] in markets and not product['post_only'] and not product['limit_only'] and not product['cancel_only']:
+                markets[product['quote_currency']][Product.build(product['id'])] = product
+        return markets
 
-    def get_historical(self, product_id, begin, end):
+    def get_historical(self, product_id, begin, end, granularity=86400):
         tickers = self.public_client.get_product_historic_rates(
-                    product_id, start=begin, end=end, granularity=86400)
+                    product_id, start=begin, end=end, granularity=granularity)
         return tickers
             
-    def place_market_order(self, product_id: str, quote_amount: float):
+    def place_market_order(self, product_id: str, quote_amount: float, client_oid=None):
         order = self.auth_client.place_market_order(
-                product_id, side="buy", funds=quote_amount)
+                product_id, side="buy", funds=quote_amount, client_oid=client_oid)
         return order
 
+    def find_order(self, client_oid):
+        order = self.auth_client._send_message('get', f"/orders/client:{client_oid}")
+        if "id" in order:
+            return order
+        return None
+
 
 class KrakenExchange:
-    def __init__(self, key_data):
+    # kraken legacy asset names, products use the usual symbols
+    ASSET_ALIASES = {"XBT": "BTC", "XDG": "DOGE"}
+    # kraken OHLC rows are [time, open, high, low, close, vwap, volume, count]
+    OHLC_COLUMNS = [0, 3, 2, 1, 4, 6]
 
-        key = key_data['key']
-        if key is not None and key.strip() != "":
-            api = krakenex.API(key_data['key'], key_data['b64secret'])
-        else:
-            api = krakenex.API()
-        self.kraken = KrakenAPI(api)
+    def __init__(self, key_data, api=None):
+        """`api` replaces the krakenex client, e.g. with one replaying recorded responses."""
+        if api is None:
+            import krakenex
+            key = key_data['key']
+            if key is not None and key.strip() != "":
+                api = krakenex.API(key_data['key'], key_data['b64secret'])
+            else:
+                api = krakenex.API()
+        self.api = api
+        # product id -> kraken pair info, filled by get_markets or from a cached listing
+        self.pairs: Dict[str, Dict] = {}
 
-    def get_historical(self, product_id, begin, end):
-        pass
+    def query(self, method, data=None, private=False):
+        """(result, None) or (None, error message) of a kraken api call."""
+        try:
+            if private:
+                res = self.api.query_private(method, data=data)
+            else:
+                res = self.api.query_public(method, data=data)
+        except Exception as ex:
+            return None, str(ex)
+        if len(res.get('error', [])) > 0:
+            return None, ", ".join(res['error'])
+        return res['result'], None
 
-    def place_market_order(self, product_id, quote_amount):
-        pass
+    def product_id(self, wsname) -> str:
+        base, quote = wsname.split("/")
+        return f"{self.ASSET_ALIASES.get(base, base)}-{self.ASSET_ALIASES.get(quote, quote)}"
+
+    def load_pairs(self, listing: Dict[str, Dict]):
+        """Pair infos of a listing get_markets returned earlier, e.g. kept in a metadata cache."""
+        for pid, data in listing.items():
+            if 'pair' in data:
+                self.pairs[pid] = data
+
+    def pair(self, product_id) -> str:
+        if product_id in self.pairs:
+            return self.pairs[product_id]['pair']
+        aliases = {v: k for k, v in self.ASSET_ALIASES.items()}
+        product = Product.build(product_id)
+        return aliases.get(product.base, product.base) + aliases.get(product.quote, product.quote)
+
+    def get_historical(self, product_id, begin, end, granularity=86400):
+        """Candles between begin and end as a (N x 6) array of [time, low, high, open, close, volume]."""
+        begin = int(begin.timestamp())
+        end = int(end.timestamp())
+        pair = self.pair(product_id)
+        chunks = []
+        since = begin - 1
+        while True:
+            result, error = self.query(
+                'OHLC', {'pair': pair, 'interval': granularity // 60, 'since': since})
+            if error is not None:
+                return {'message': error}
+            rows = next(v for k, v in result.items() if k != 'last')
+            if len(rows) == 0:
+                break
+            # one conversion of the whole page, columns picked in the engine order
+            chunk = np.array(rows, dtype=object)[:, self.OHLC_COLUMNS].astype(float)
+            chunks.append(chunk[(chunk[:, 0] >= begin) & (chunk[:, 0] <= end)])
+            # the cursor stops moving once the most recent candle is reached
+            last = int(result['last'])
+            if chunk[-1, 0] >= end or last <= since:
+                break
+            since = last
+        if len(chunks) == 0:
+            return np.empty((0, 6))
+        return np.concatenate(chunks)
+
+    def place_market_order(self, product_id, quote_amount, client_oid=None):
+        pair = self.pair(product_id)
+        result, error = self.query('Ticker', {'pair': pair})
+        if error is not None:
+            return {'message': error}
+        # kraken market orders are sized in base currency, from the last trade price
+        price = float(next(iter(result.values()))['c'][0])
+        info = self.pairs.get(product_id, {})
+        decimals = int(info.get('lot_decimals', 8))
+        volume = truncate_to_increment(quote_amount / price, Decimal(1).scaleb(-decimals))
+        # kraken refuses orders below the pair minimum volume, don't send them
+        ordermin = float(info.get('ordermin', 0))
+        if volume < ordermin:
+            return {'message': f"ordermin not met: volume {volume:.{decimals}f} below {ordermin} for {quote_amount} {product_id}"}
+        order = {'pair': pair, 'type': "buy", 'ordertype': "market",
+                 'volume': f"{volume:.{decimals}f}"}
+        if client_oid is not None:
+            order['userref'] = self.userref(client_oid)
+        result, error = self.query('AddOrder', order, private=True)
+        if error is not None:
+            return {'message': error}
+        return {'id': result['txid'][0], **result}
+
+    @staticmethod
+    def userref(client_oid) -> int:
+        # kraken only takes a 32 bit signed reference
+        return int(client_oid.replace("-", "")[:8], 16) & 0x7fffffff
+
+    def find_order(self, client_oid):
+        userref = self.userref(client_oid)
+        for method, key in (('OpenOrders', 'open'), ('ClosedOrders', 'closed')):
+            result, error = self.query(method, {'userref': userref}, private=True)
+            if error is None and len(result[key]) > 0:
+                return {'id': next(iter(result[key]))}
+        return None
 
     def get_account(self, base_currency):
-        pass
+        result, error = self.query('Balance', private=True)
+        if error is not None:
+            print(f"Failed to retrieve kraken balance: {error}")
+            return None
+        for asset in (base_currency, f"Z{base_currency}", f"X{base_currency}"):
+            if asset in result:
+                return {'currency': base_currency, 'balance': result[asset]}
+        return None
 
     def get_tradable_products(self, base_currency) -> Dict[str, Dict]:
-        products = self.kraken.get_tradable_asset_pairs()
-        for index, row in products.iterrows():
-            print(f"{index}: {row['ordermin']}")
-            print(row)
-        tradable_products = {}
-        for product in products:
-            if not product['trading_disabled'] and product['status'] == "online" and product['quote_currency'] == base_currency:
-                tradable_products[Product.build(product['id'])] = product and not product['cancel_only'] and not product['post_only'] and not product['limit_only']
-        return tradable_products
+        return self.get_markets([base_currency])[base_currency]
+
+    def get_markets(self, quote_currencies: List[str]) -> Dict[str, Dict[Product, Dict]]:
+        result, error = self.query('AssetPairs')
+        if error is not None:
+            raise RuntimeError(f"Unable to retrieve kraken asset pairs: {error}")
+        markets = {currency: {} for currency in quote_currencies}
+        for name, info in result.items():
+            # darkpool pairs (.d) have no wsname
+            if 'wsname' not in info or info.get('status', "online") != "online":
+                continue
+            pid = self.product_id(info['wsname'])
+            product = Product.build(pid)
+            if product.quote not in markets:
+                continue
+            decimals = info.get('cost_decimals', info.get('pair_decimals', 2))
+            data = {
+                'id': pid,
+                'pair': name,
+                'altname': info.get('altname'),
+                'min_market_funds': str(info.get('costmin', 0)),
+                'quote_increment': str(Decimal(1).scaleb(-int(decimals))),
+                'ordermin': str(info.get('ordermin', 0)),
+                'lot_decimals': int(info.get('lot_decimals', 8)),
+            }
+            self.pairs[pid] = data
+            markets[product.quote][product] = data
+        return markets
@@ -0,0 +1,132 @@
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from metrics import registry
+from portfolio import Product
+from ratelimit import TokenBucket
+
+# failures worth retrying, anything else (funds, product offline...) fails the order right away
+TRANSIENT_ERRORS = ("rate limit", "internal server error",
+                    "service unavailable", "timeout", "try again")
+
+
+def is_transient(response) -> bool:
+    return isinstance(response, dict) and any(e in str(response.get('message', '')).lower() for e in TRANSIENT_ERRORS)
+
+
+def is_network_error(ex: Exception) -> bool:
+    """Exceptions of a request that may or may not have reached the exchange, anything else is a bug or a refusal."""
+    if isinstance(ex, (ConnectionError, TimeoutError, socket.timeout)):
+        return True
+    try:
+        import requests
+    except ImportError:
+        return False
+    return isinstance(ex, requests.exceptions.RequestException)
+
+
+class OrderResult:
+    def __init__(self, product: Product, funds, client_oid):
+        self.product = product
+        self.funds = funds
+        self.client_oid = client_oid
+        self.order_id = None
+        self.error = None
+        self.attempts = 0
+        self.elapsed = 0.0
+
+    @property
+    def confirmed(self):
+        return self.order_id is not None
+
+    def __str__(self):
+        if self.confirmed:
+            return f"{self.product.id} {self.funds} {self.product.quote}: order {self.order_id} confirmed ({self.attempts} attempts, {self.elapsed:.2f}s)"
+        return f"{self.product.id} {self.funds} {self.product.quote}: failed after {self.attempts} attempts: {self.error}"
+
+
+class OrderExecutor:
+    """Submits market orders concurrently under the exchange private rate limit.
+
+    Every order gets a client_oid derived from the run id and the product, so a retry (or a
+    re-run with the same run id) can be matched to an order the exchange already accepted.
+    """
+
+    def __init__(self, exchange, limiter: TokenBucket, workers=4, retries=3, backoff=1.0, sleep=time.sleep):
+        self.exchange = exchange
+        self.limiter = limiter
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+
+    @staticmethod
+    def client_oid(run_id, product: Product) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{run_id}/{product.id}"))
+
+    def execute_one(self, product: Product, funds, run_id, resume=False) -> OrderResult:
+        result = OrderResult(product, funds, self.client_oid(run_id, product))
+        started = time.monotonic()
+        if resume:
+            # an interrupted run may have placed this order already
+            order = self.find(result.client_oid)
+            if order is not None:
+                result.order_id = order['id']
+                result.elapsed = time.monotonic() - started
+                return result
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            result.attempts += 1
+            try:
+                order = self.exchange.place_market_order(
+                    product.id, funds, client_oid=result.client_oid)
+            except Exception as ex:
+                if not is_network_error(ex):
+                    result.error = f"{type(ex).__name__}: {ex}"
+                    break
+                order = {'message': f"timeout: {ex}"}
+            if "id" in order:
+                result.order_id = order['id']
+                result.error = None
+                break
+            result.error = order.get('message', order)
+            if not is_transient(order):
+                break
+            # a timeout or a 5xx may still have been accepted, look the order up before placing it again
+            found = self.find(result.client_oid)
+            if found is not None:
+                result.order_id = found['id']
+                result.error = None
+                break
+            if attempt == self.retries:
+                break
+            registry.count("api_retries", endpoint="place_market_order")
+            registry.count("backoff_sleep_seconds", delay, endpoint="place_market_order")
+            self.sleep(delay)
+            delay *= 2
+        result.elapsed = time.monotonic() - started
+        return result
+
+    def find(self, client_oid):
+        try:
+            self.limiter.acquire()
+            return self.exchange.find_order(client_oid)
+        except Exception:
+            return None
+
+    def execute(self, orders: Dict[Product, float], run_id=None, resume=False) -> List[OrderResult]:
+        """Place all orders, the report keeps the orders order.
+
+        With `resume` the orders of a previous attempt of the same run id are looked up first and
+        only the ones the exchange doesn't know are placed.
+        """
+        if run_id is None:
+            run_id = uuid.uuid4()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.execute_one, p, funds, run_id, resume)
+                       for p, funds in orders.items()]
+            return [f.result() for f in futures]
@@ -0,0 +1,66 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, Tuple
+
+from metrics import registry
+from ratelimit import TokenBucket
+from tickers import DAY
+
+
+def is_rate_limited(response) -> bool:
+    # coinbase answers with {'message': 'Public rate limit exceeded'} (HTTP 429)
+    return isinstance(response, dict) and "rate limit" in str(response.get('message', '')).lower()
+
+
+class HistoricalFetcher:
+    """Fetches historical rates from a bounded thread pool, throttled by a shared token bucket."""
+
+    def __init__(self, exchange, limiter: TokenBucket, workers=4, retries=5, backoff=1.0, sleep=time.sleep):
+        self.exchange = exchange
+        self.limiter = limiter
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.requests = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    def fetch_one(self, product_id, begin, end, granularity=DAY):
+        """Candles of the range, or an error {'message': ...} once the retries are exhausted."""
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            with self.lock:
+                self.requests += 1
+            try:
+                tickers = self.exchange.get_historical(
+                    product_id, begin, end, granularity)
+            except Exception as ex:
+                error = str(ex)
+            else:
+                if not is_rate_limited(tickers):
+                    return tickers
+                error = tickers
+                with self.lock:
+                    self.rate_limited += 1
+                registry.count("api_rate_limited", endpoint="get_historical")
+                self.limiter.drain()
+            if attempt < self.retries:
+                registry.count("api_retries", endpoint="get_historical")
+                registry.count("backoff_sleep_seconds", delay, endpoint="get_historical")
+                print(
+                    f"Retrying {product_id} historical data in {delay:.1f}s ({error})")
+                self.sleep(delay)
+                delay *= 2
+        print(f"Giving up on {product_id} historical data: {error}")
+        # not an empty answer: the range must be requested again on the next run
+        return {'message': str(error.get('message', error)) if isinstance(error, dict) else error}
+
+    def fetch(self, jobs: Iterable[Tuple]) -> Iterator[Tuple]:
+        """Yield (job, tickers) for every (product_id, begin, end[, granularity]) job as soon as it completes."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.fetch_one, *job): job for job in jobs}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
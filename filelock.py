@@ -0,0 +1,52 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (windows), files are only safe from a single process
+    fcntl = None
+
+
+@contextmanager
+def locked(fd):
+    """Exclusive lock of an open file descriptor across processes, readers don't take it."""
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield fd
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock_file(path):
+    """Exclusive lock on `path`.lock, for read-modify-write of files replaced atomically."""
+    directory = os.path.dirname(path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        with locked(fd):
+            yield
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data: str):
+    """Write through a temporary file renamed over `path`, readers see the old or the new content."""
+    directory = os.path.dirname(path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -15,6 +15,7 @@ from rich.table import Table
 from rich.text import Text
 
 from portfolio import Order, Portfolio
+from tickers import TickerStore, day_index
 
 
 def make_layout() -> Layout:
@@ -47,26 +48,28 @@ def make_order_grid(orders: List[Order]):
     table.add_column("Unit Price", justify="right")
 
     for o in orders:
-        table.add_row(
-            f"{o.buy_time.strftime('%Y-%m-%d')}",
-            f"{o.product.base} {o.buy_currency:.3f}",
-            f"{o.product.quote} {o.buy_price_with_fee:.3f}",
-            f"{o.product.base}/{o.product.quote} {o.unit_price:.3f}"
-        )
+        add_order_row(table, o)
     return table
 
 
-def make_summary(portfolio: Portfolio, prices, base_currency):
+def add_order_row(table: Table, o: Order):
+    table.add_row(
+        f"{o.buy_time.strftime('%Y-%m-%d')}",
+        f"{o.product.base} {o.buy_currency:.3f}",
+        f"{o.product.quote} {o.buy_price_with_fee:.3f}",
+        f"{o.product.base}/{o.product.quote} {o.unit_price:.3f}"
+    )
+
+
+def make_summary(portfolio: Portfolio, prices: TickerStore, base_currency):
     grid = Table.grid(expand=True)
     grid.add_column("", justify="left")
     grid.add_column("", justify="right")
     grid.add_column("", justify="left")
-    nowts = str(datetime.datetime.now().replace(
-        hour=0, minute=0, second=0, microsecond=0).timestamp())
+    today = day_index(datetime.datetime.now())
     total = 0.0
-    for p in portfolio.portfolio:
-        product_value = portfolio.portfolio[p] * \
-            prices[p.id][nowts]["close"]
+    for p, holding in portfolio.holdings.items():
+        product_value = holding.quantity * prices.close(p.id, today)
         total += product_value
 
     total_spent = portfolio.get_total_spent()
@@ -79,22 +82,15 @@ def make_summary(portfolio: Portfolio, prices, base_currency):
     return Panel(grid, title="Earning/Loss Summary", border_style="green")
 
 
-def make_portfolio(portfolio: Portfolio, prices):
+def make_portfolio(portfolio: Portfolio, prices: TickerStore):
     table = Table(title="Portfolio", expand=True)
     table.add_column("Curr", no_wrap=True)
     table.add_column("Amount", no_wrap=True)
     table.add_column("Value", justify="right")
-    nowts = str(datetime.datetime.now().replace(
-        hour=0, minute=0, second=0, microsecond=0).timestamp())
-    for p in portfolio.portfolio:
-        spent = 0.0
-        for order in portfolio.orders:
-            if order.product == p:
-                spent += order.buy_price_with_fee
-
-        product_value = portfolio.portfolio[p] * \
-            prices[p.id][nowts]["close"]
-        val = portfolio.portfolio[p]
+    today = day_index(datetime.datetime.now())
+    for p, holding in portfolio.holdings.items():
+        product_value = holding.quantity * prices.close(p.id, today)
+        val = holding.quantity
         table.add_row(
             f"[magenta]{p.base}[/magenta]",
             f"[magenta]{val:.2f}[/magenta]",
@@ -102,22 +98,16 @@ def make_portfolio(portfolio: Portfolio, prices):
     return table
 
 
-def make_gain(portfolio: Portfolio, prices):
+def make_gain(portfolio: Portfolio, prices: TickerStore):
     table = Table(expand=True)
     table.add_column("Curr", no_wrap=True)
     table.add_column("Gain")
-    nowts = str(datetime.datetime.now().replace(
-        hour=0, minute=0, second=0, microsecond=0).timestamp())
+    today = day_index(datetime.datetime.now())
     max = 0.0
     gains = {}
-    for p in portfolio.portfolio:
-        spent = 0.0
-        for order in portfolio.orders:
-            if order.product == p:
-                spent += order.buy_price_with_fee
-        product_value = portfolio.portfolio[p] * \
-            prices[p.id][nowts]["close"]
-        gain = product_value/spent*100.0
+    for p, holding in portfolio.holdings.items():
+        product_value = holding.quantity * prices.close(p.id, today)
+        gain = product_value/holding.spent*100.0
         if gain > max:
             max = gain
 
@@ -138,13 +128,17 @@ class Header:
     def __init__(self, periods, interval):
         self.periods = periods
         self.interval = interval
+        self.completed = None
 
     def __rich__(self) -> Panel:
         grid = Table.grid(expand=True)
         grid.add_column(justify="center", ratio=1)
         grid.add_column(justify="right")
+        progress = ""
+        if self.completed is not None and self.completed < self.periods:
+            progress = f" ({self.completed}/{self.periods} done)"
         grid.add_row(
-            f"[b]Simulation[/b] {self.periods} periods of {self.interval} days",
+            f"[b]Simulation[/b] {self.periods} periods of {self.interval} days{progress}",
             datetime.datetime.now().ctime(),
         )
         return Panel(grid, style="white on blue")
@@ -153,3 +147,106 @@ class Header:
 def make_footer(strategy, buy_amount, base_currency, limit_products):
     return Panel(
         f"[b]Strategy:[/b] {strategy} | [b]Buy Amount:[/b] {buy_amount} {base_currency} | [b]Max products:[/b] {limit_products}")
+
+
+def make_tune_table(results: List[Dict], base_currency):
+    table = Table(title="Tuning results", expand=True)
+    table.add_column("Strategy", no_wrap=True)
+    table.add_column("Limit", justify="right")
+    table.add_column("Interval", justify="right")
+    table.add_column("Orders", justify="right")
+    table.add_column("Spent", justify="right", style="red")
+    table.add_column("Gain", justify="right", style="green")
+    for r in results:
+        table.add_row(
+            r['strategy'],
+            f"{r['limit']}",
+            f"{r['interval']}",
+            f"{r['orders']}",
+            f"{base_currency} {r['spent']:.2f}",
+            f"{r['gain']:.2f}%")
+    return table
+
+
+def make_robustness_table(summary: Dict, title):
+    table = Table(title=title, expand=True)
+    for column in ("Runs", "Skipped", "Mean", "Std", "Worst", "P5", "P25", "Median", "P75", "P95", "Best", "Losing"):
+        table.add_column(column, justify="right")
+    if 'mean' not in summary:
+        table.add_row(f"{summary['runs']}", f"{summary['skipped']}", *["-"] * 10)
+        return table
+    table.add_row(
+        f"{summary['runs']}",
+        f"{summary['skipped']}",
+        *[f"{summary[k]:.2f}%" for k in ("mean", "std", "worst", "p5", "p25", "p50", "p75", "p95", "best")],
+        f"{summary['losing']:.1f}% of runs")
+    return table
+
+
+def make_portfolios_table(portfolios: Dict[str, Portfolio], prices: TickerStore, title, label):
+    table = Table(title=title, expand=True)
+    table.add_column(label, no_wrap=True)
+    table.add_column("Orders", justify="right")
+    table.add_column("Products", justify="right")
+    table.add_column("Spent", justify="right", style="red")
+    table.add_column("Worth", justify="right", style="green")
+    table.add_column("Gain", justify="right", style="green")
+    today = day_index(datetime.datetime.now())
+    for name, portfolio in portfolios.items():
+        total = 0.0
+        for p, holding in portfolio.holdings.items():
+            total += holding.quantity * prices.close(p.id, today)
+        total_spent = portfolio.get_total_spent()
+        gain = total/total_spent*100.0 if total_spent > 0 else 0.0
+        table.add_row(
+            name,
+            f"{len(portfolio.orders)}",
+            f"{len(portfolio.holdings)}",
+            f"{portfolio.base_currency} {total_spent:.2f}",
+            f"{portfolio.base_currency} {total:.2f}",
+            f"{gain:.2f}%")
+    return table
+
+
+class SimulationDashboard:
+    """Simulation layout updated as periods complete, panels are only rebuilt when their data changed."""
+
+    def __init__(self, periods, interval, prices: TickerStore, strategy, buy_amount, base_currency, limit_products):
+        self.prices = prices
+        self.base_currency = base_currency
+        self.header = Header(periods, interval)
+        self.orders = make_order_grid([])
+        self.shown_orders = 0
+        self.portfolio = None
+        self.version = 0
+        self.rendered_version = 0
+
+        self.layout = make_layout()
+        self.layout["header"].update(self.header)
+        self.layout["orders"].update(self.orders)
+        self.layout["footer"].update(make_footer(
+            strategy, buy_amount, base_currency, limit_products))
+
+    def update(self, portfolio: Portfolio, completed=None):
+        # the orders table only grows, new orders are appended to it
+        for o in portfolio.orders[self.shown_orders:]:
+            add_order_row(self.orders, o)
+        if len(portfolio.orders) != self.shown_orders or completed != self.header.completed:
+            self.shown_orders = len(portfolio.orders)
+            self.header.completed = completed
+            self.portfolio = portfolio
+            self.version += 1
+
+    def render(self) -> bool:
+        """Rebuild the changed panels, returns False when there is nothing new to show."""
+        if self.version == self.rendered_version:
+            return False
+        if self.portfolio is not None and self.portfolio.get_total_spent() > 0:
+            self.layout["summary"].update(make_summary(
+                self.portfolio, self.prices, self.base_currency))
+            self.layout["portfoliolayout"].update(
+                make_portfolio(self.portfolio, self.prices))
+            self.layout["gainlayout"].update(
+                make_gain(self.portfolio, self.prices))
+        self.rendered_version = self.version
+        return True
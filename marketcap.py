@@ -0,0 +1,113 @@
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from filelock import atomic_write, lock_file
+from tickers import day_index, day_to_datetime
+
+COINGECKO_MARKETS = "https://api.coingecko.com/api/v3/coins/markets?vs_currency=usd&order=market_cap_desc&per_page={count}&page=1&sparkline=false"
+
+
+def fetch_coingecko(count=100) -> List[Tuple[str, float]]:
+    """Current (symbol, market cap in usd) ranking, biggest first."""
+    import urllib.request
+    with urllib.request.urlopen(COINGECKO_MARKETS.format(count=count)) as req:
+        data = json.loads(req.read().decode())
+    return [(coin['symbol'].upper(), coin['market_cap'] or 0.0) for coin in data]
+
+
+class MarketCapSnapshots:
+    """Market cap rankings by day, kept in a json file.
+
+    Live runs reuse the ranking of the day until it is older than `ttl` seconds, every ranking
+    fetched is recorded so that simulations can replay the ranking known at each period instead
+    of today's one. Offline only the recorded file is read, nothing is fetched.
+    """
+
+    def __init__(self, path="cache/marketcap.json", ttl=3600, offline=False, fetch=fetch_coingecko, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        self.fetch = fetch
+        self.clock = clock
+        self.lock = threading.Lock()
+        # day index -> {'fetched': timestamp, 'coins': [[symbol, market cap], ...]}
+        self.snapshots: Dict[int, Dict] = self.load()
+        # day - first day -> day of the latest snapshot at or before it, -1 when there is none
+        self.first_day = 0
+        self.previous: List[int] = []
+        self.reindex()
+
+    def load(self) -> Dict[int, Dict]:
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                data = json.loads(f.read())
+            return {day_index(datetime.date.fromisoformat(day)): snapshot for day, snapshot in data.items()}
+        except Exception as ex:
+            print(f"Ignoring unreadable market cap snapshots {self.path}: {ex}")
+            return {}
+
+    def save(self):
+        if self.path is None:
+            return
+        # snapshots other processes recorded meanwhile are kept, unless newer here
+        with lock_file(self.path):
+            snapshots = self.load()
+            for day, snapshot in self.snapshots.items():
+                if day not in snapshots or snapshots[day]['fetched'] <= snapshot['fetched']:
+                    snapshots[day] = snapshot
+            data = {day_to_datetime(day).date().isoformat(): snapshots[day] for day in sorted(snapshots)}
+            atomic_write(self.path, json.dumps(data))
+
+    def reindex(self):
+        if len(self.snapshots) == 0:
+            self.first_day, self.previous = 0, []
+            return
+        days = sorted(self.snapshots)
+        self.first_day = days[0]
+        self.previous = [-1] * (days[-1] - days[0] + 1)
+        last = -1
+        for offset in range(len(self.previous)):
+            if self.first_day + offset in self.snapshots:
+                last = self.first_day + offset
+            self.previous[offset] = last
+
+    def record(self, day: int, coins: List[Tuple[str, float]], fetched=None):
+        with self.lock:
+            self.snapshots[day] = {'fetched': fetched if fetched is not None else self.clock(),
+                                   'coins': [[symbol, cap] for symbol, cap in coins]}
+            self.reindex()
+            self.save()
+
+    def at(self, day: int) -> Optional[List[Tuple[str, float]]]:
+        """Ranking known on day index `day` (the latest recorded at or before it), None when there is none."""
+        with self.lock:
+            if len(self.previous) == 0 or day < self.first_day:
+                return None
+            snapshot_day = self.previous[min(day - self.first_day, len(self.previous) - 1)]
+            if snapshot_day < 0:
+                return None
+            return [(symbol, cap) for symbol, cap in self.snapshots[snapshot_day]['coins']]
+
+    def latest(self) -> Optional[List[Tuple[str, float]]]:
+        """Today's ranking, fetched again once older than the ttl (the last recorded one offline)."""
+        today = day_index(datetime.datetime.fromtimestamp(self.clock()))
+        with self.lock:
+            snapshot = self.snapshots.get(today)
+            fresh = snapshot is not None and self.clock() - snapshot['fetched'] <= self.ttl
+        if self.offline or fresh:
+            return self.at(today)
+        try:
+            coins = self.fetch()
+        except Exception as ex:
+            if self.at(today) is None:
+                raise
+            print(f"Failed to refresh market caps, using the last recorded ranking: {ex}")
+            return self.at(today)
+        self.record(today, coins)
+        return self.at(today)
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from exchange import Exchange
+from filelock import atomic_write, lock_file
+from metrics import InstrumentedExchange
+from portfolio import Product
+
+# order errors telling that the cached listing no longer matches the exchange
+PRODUCT_ERRORS = ("product not found", "product offline", "trading disabled",
+                  "post only", "limit only", "cancel only", "funds is",
+                  "min_market_funds", "quote_increment", "unknown asset pair",
+                  "ordermin not met", "order minimum not met")
+
+# one exchange (and so one client/http session) per config in this process
+_exchanges: Dict[str, 'CachedExchange'] = {}
+_exchanges_lock = threading.Lock()
+
+
+def is_product_error(response) -> bool:
+    return isinstance(response, dict) and any(e in str(response.get('message', '')).lower() for e in PRODUCT_ERRORS)
+
+
+class CachedExchange:
+    """Exchange wrapper keeping product listings for a while, in memory and on disk.
+
+    The listing is fetched again once older than `products_ttl` seconds, or right after an order
+    fails because of the product itself (not found, offline, constraints changed...). Accounts
+    are only kept in memory for `accounts_ttl` seconds, balances are never written to disk.
+    """
+
+    def __init__(self, exchange, path="cache/metadata.json", products_ttl=6 * 3600, accounts_ttl=300, clock=time.time):
+        self.exchange = exchange
+        self.path = path
+        self.products_ttl = products_ttl
+        self.accounts_ttl = accounts_ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # section -> base currency -> {'fetched': timestamp, 'data': ...}
+        self.entries = self.load()
+        # base currency -> (fetched timestamp, account), found accounts only
+        self.accounts: Dict[str, Tuple[float, Dict]] = {}
+        self.requests = 0
+
+    def load(self) -> Dict[str, Dict]:
+        entries = {'products': {}}
+        if self.path is None or not os.path.exists(self.path):
+            return entries
+        try:
+            with open(self.path, "r") as f:
+                # accounts older versions saved are dropped with the next save
+                entries['products'] = json.loads(f.read()).get('products', {})
+        except Exception as ex:
+            print(f"Ignoring unreadable metadata cache {self.path}: {ex}")
+        return entries
+
+    def save(self, removed=()):
+        """Write the entries, `removed` (section, key) entries are dropped (the whole section when key is None)."""
+        if self.path is None:
+            return
+        # entries other processes saved meanwhile are kept, unless newer here
+        with lock_file(self.path):
+            entries = self.load()
+            for section, key in removed:
+                if key is None:
+                    entries[section] = {}
+                else:
+                    entries[section].pop(key, None)
+            for section, items in self.entries.items():
+                for key, entry in items.items():
+                    other = entries.setdefault(section, {}).get(key)
+                    if other is None or other['fetched'] <= entry['fetched']:
+                        entries[section][key] = entry
+            atomic_write(self.path, json.dumps(entries))
+
+    def cached(self, section, key, ttl, fetch):
+        with self.lock:
+            entry = self.entries[section].get(key)
+            if entry is not None and self.clock() - entry['fetched'] <= ttl:
+                return entry['data']
+        data = fetch()
+        self.requests += 1
+        with self.lock:
+            self.entries[section][key] = {'fetched': self.clock(), 'data': data}
+            self.save()
+        return data
+
+    def invalidate(self, base_currency=None):
+        """Forget the product listing of base_currency (all of them when None)."""
+        with self.lock:
+            if base_currency is None:
+                self.entries['products'] = {}
+            else:
+                self.entries['products'].pop(base_currency, None)
+            self.save(removed=[('products', base_currency)])
+
+    def get_tradable_products(self, base_currency) -> Dict[Product, Dict]:
+        listing = self.cached('products', base_currency, self.products_ttl, lambda: {
+            p.id: data for p, data in self.exchange.get_tradable_products(base_currency).items()})
+        if hasattr(self.exchange, "load_pairs"):
+            # a listing read from the cache never went through the exchange, orders need its pair infos
+            self.exchange.load_pairs(listing)
+        return {Product.build(pid): data for pid, data in listing.items()}
+
+    def get_markets(self, quote_currencies: List[str]) -> Dict[str, Dict[Product, Dict]]:
+        """Tradable products of every quote currency, the expired listings refreshed with a single request."""
+        with self.lock:
+            expired = [c for c in quote_currencies if c not in self.entries['products']
+                       or self.clock() - self.entries['products'][c]['fetched'] > self.products_ttl]
+        if len(expired) > 0:
+            if hasattr(self.exchange, "get_markets"):
+                markets = self.exchange.get_markets(expired)
+                self.requests += 1
+            else:
+                markets = {c: self.exchange.get_tradable_products(c) for c in expired}
+                self.requests += len(expired)
+            with self.lock:
+                for currency, products in markets.items():
+                    self.entries['products'][currency] = {'fetched': self.clock(),
+                                                          'data': {p.id: data for p, data in products.items()}}
+                self.save()
+        return {c: self.get_tradable_products(c) for c in quote_currencies}
+
+    def get_account(self, base_currency):
+        with self.lock:
+            entry = self.accounts.get(base_currency)
+            if entry is not None and self.clock() - entry[0] <= self.accounts_ttl:
+                return entry[1]
+        account = self.exchange.get_account(base_currency)
+        self.requests += 1
+        # a missing account is asked again, it may have been funded since
+        if account is not None:
+            with self.lock:
+                self.accounts[base_currency] = (self.clock(), account)
+        return account
+
+    def get_historical(self, product_id, begin, end, granularity=86400):
+        return self.exchange.get_historical(product_id, begin, end, granularity)
+
+    def place_market_order(self, product_id, quote_amount, client_oid=None):
+        order = self.exchange.place_market_order(
+            product_id, quote_amount, client_oid=client_oid)
+        if is_product_error(order):
+            print(f"Order for {product_id} rejected ({order['message']}), refreshing products on next use")
+            self.invalidate(Product.build(product_id).quote)
+        return order
+
+    def find_order(self, client_oid):
+        return self.exchange.find_order(client_oid)
+
+
+def build_exchange(data: Dict) -> CachedExchange:
+    """Cached exchange for the config, built once per process and shared afterwards."""
+    key = json.dumps(data, sort_keys=True)
+    with _exchanges_lock:
+        if key not in _exchanges:
+            _exchanges[key] = CachedExchange(InstrumentedExchange(Exchange.build(data)),
+                                             data.get('metadata_file', "cache/metadata.json"),
+                                             data.get('products_ttl', 6 * 3600),
+                                             data.get('accounts_ttl', 300))
+        return _exchanges[key]
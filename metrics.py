@@ -0,0 +1,207 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from filelock import atomic_write
+
+# latency histogram upper bounds (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "cbportfolio"
+
+
+def _key(name, labels: Dict) -> Tuple:
+    return (name,) + tuple(sorted(labels.items()))
+
+
+def _format_labels(labels) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Tracing spans, counters and latency histograms of a run, thread-safe.
+
+    Spans keep their name, parent, start and duration. Past `max_spans` only the per name totals
+    are kept, so that thousands of requests don't pile up in memory.
+    """
+
+    def __init__(self, clock=time.perf_counter, max_spans=1000):
+        self.clock = clock
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = clock()
+        self.spans: List[Dict] = []
+        self.next_id = 0
+        self.span_totals: Dict[str, List[float]] = {}
+        self.counters: Dict[Tuple, float] = {}
+        self.histograms: Dict[Tuple, Histogram] = {}
+
+    def reset(self):
+        with self.lock:
+            self.started = self.clock()
+            self.spans = []
+            self.span_totals = {}
+            self.counters = {}
+            self.histograms = {}
+
+    @contextmanager
+    def span(self, name, **attributes):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        parent = stack[-1] if len(stack) > 0 else None
+        with self.lock:
+            self.next_id += 1
+            span_id = self.next_id
+        span = {'id': span_id, 'name': name, 'parent': parent['id'] if parent is not None else None,
+                'thread': threading.current_thread().name, 'start': self.clock() - self.started,
+                'attributes': attributes}
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span['duration'] = self.clock() - self.started - span['start']
+            with self.lock:
+                total = self.span_totals.setdefault(name, [0, 0.0])
+                total[0] += 1
+                total[1] += span['duration']
+                if len(self.spans) < self.max_spans:
+                    self.spans.append(span)
+
+    def count(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def report(self) -> Dict:
+        """Json-able summary of the run."""
+        with self.lock:
+            return {
+                'duration': self.clock() - self.started,
+                'phases': {name: {'count': c, 'seconds': s} for name, (c, s) in self.span_totals.items()},
+                'counters': [dict(labels, name=name, value=v) for (name, *labels), v in self.counters.items()],
+                'histograms': [dict(labels, name=name, count=h.count, sum=h.sum,
+                                    buckets=dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts)))
+                               for (name, *labels), h in self.histograms.items()],
+                'spans': list(self.spans),
+            }
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            lines.append(f"# TYPE {PREFIX}_phase_seconds_total counter")
+            for name, (_, seconds) in sorted(self.span_totals.items()):
+                lines.append(f'{PREFIX}_phase_seconds_total{{phase="{name}"}} {seconds}')
+            lines.append(f"# TYPE {PREFIX}_phase_calls_total counter")
+            for name, (calls, _) in sorted(self.span_totals.items()):
+                lines.append(f'{PREFIX}_phase_calls_total{{phase="{name}"}} {calls}')
+            typed = set()
+            for (name, *labels), value in sorted(self.counters.items(), key=lambda i: str(i[0])):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                    typed.add(name)
+                lines.append(f"{PREFIX}_{name}_total{_format_labels(labels)} {value}")
+            for (name, *labels), h in sorted(self.histograms.items(), key=lambda i: str(i[0])):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip([str(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}_{name}_bucket{_format_labels(list(labels) + [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {h.sum}")
+                lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, report_file=None, prometheus_file=None):
+        # rewritten after every serve run, a collector never reads a half written file
+        if report_file is not None:
+            atomic_write(report_file, json.dumps(self.report(), indent=2, default=str))
+        if prometheus_file is not None:
+            atomic_write(prometheus_file, self.prometheus())
+
+
+# metrics of this process, every component reports here
+registry = Metrics()
+
+
+def traced(name):
+    """Decorator running the function in a span of the process registry."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with registry.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class InstrumentedExchange:
+    """Exchange wrapper timing every api call per endpoint, counting errors and response bytes."""
+
+    METHODS = ("get_historical", "get_account", "get_tradable_products", "get_markets",
+               "place_market_order", "find_order")
+
+    def __init__(self, exchange, metrics: Metrics = registry):
+        self.exchange = exchange
+        self.metrics = metrics
+        self.local = threading.local()
+        # http clients of the exchange, to count the bytes they receive
+        for client in (getattr(exchange, "public_client", None), getattr(exchange, "auth_client", None),
+                       getattr(exchange, "api", None)):
+            session = getattr(client, "session", None)
+            if session is not None and hasattr(session, "hooks"):
+                session.hooks.setdefault('response', []).append(self.on_response)
+
+    def on_response(self, response, *args, **kwargs):
+        endpoint = getattr(self.local, "endpoint", "other")
+        self.metrics.count("api_response_bytes", len(response.content), endpoint=endpoint)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.exchange, name)
+        if name not in self.METHODS:
+            return attribute
+
+        def call(*args, **kwargs):
+            self.local.endpoint = name
+            start = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception:
+                self.metrics.count("api_errors", endpoint=name)
+                raise
+            finally:
+                self.metrics.observe("api_latency_seconds", time.perf_counter() - start, endpoint=name)
+                self.metrics.count("api_calls", endpoint=name)
+            if isinstance(result, dict) and 'message' in result and 'id' not in result:
+                self.metrics.count("api_errors", endpoint=name)
+            return result
+        return call
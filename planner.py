@@ -0,0 +1,89 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from tickers import CLOSE, TickerStore
+
+# coinbase returns at most 300 candles per historic rates request, a local day
+# can straddle two UTC candles so one slot is kept free
+MAX_CANDLES = 300
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    res = []
+    for d0, d1 in sorted(intervals):
+        if res and d0 <= res[-1][1] + 1:
+            res[-1][1] = max(res[-1][1], d1)
+        else:
+            res.append([d0, d1])
+    return res
+
+
+def runs(days: np.ndarray) -> List[Tuple[int, int]]:
+    """Consecutive runs of sorted days as (first, last) pairs."""
+    if len(days) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(days) > 1)
+    starts = np.concatenate(([days[0]], days[breaks + 1]))
+    ends = np.concatenate((days[breaks], [days[-1]]))
+    return [(int(s), int(e)) for s, e in zip(starts, ends)]
+
+
+class FetchPlanner:
+    """Plans the fewest historic rates requests covering the days missing from the store."""
+
+    def __init__(self, store: TickerStore, empty: Dict[str, List[List[int]]], stale: Optional[Dict[str, List[int]]] = None, max_candles=MAX_CANDLES):
+        self.store = store
+        # cached candles taken before their day was over, fetched again
+        self.stale = stale if stale is not None else {}
+        # known empty day ranges per product (pre-listing, delisted), never requested again
+        self.empty = empty
+        self.span = max_candles - 1
+        self.changed = False
+
+    def missing(self, product_id, first_day: int, last_day: int) -> np.ndarray:
+        missing = np.ones(last_day - first_day + 1, dtype=bool)
+        days, candles = self.store.range(product_id, first_day, last_day)
+        if len(days) > 0:
+            missing[days[0] - first_day:days[-1] - first_day + 1] = np.isnan(candles[:, CLOSE])
+        for day in self.stale.get(product_id, []):
+            if first_day <= day <= last_day:
+                missing[day - first_day] = True
+        for d0, d1 in self.empty.get(product_id, []):
+            lo = max(d0, first_day)
+            hi = min(d1, last_day)
+            if lo <= hi:
+                missing[lo - first_day:hi - first_day + 1] = False
+        return np.flatnonzero(missing) + first_day
+
+    def plan(self, product_id, first_day: int, last_day: int) -> List[Tuple[int, int]]:
+        """Requested (first, last) day ranges, coalescing gaps as long as they fit in one request."""
+        requests = []
+        for g0, g1 in runs(self.missing(product_id, first_day, last_day)):
+            if requests and g1 - requests[-1][0] < self.span:
+                requests[-1][1] = g1
+                continue
+            if requests and g0 - requests[-1][0] < self.span:
+                # fill the current request up, the remaining part of the gap starts a new one
+                requests[-1][1] = requests[-1][0] + self.span - 1
+                g0 = requests[-1][1] + 1
+            while g0 <= g1:
+                requests.append([g0, min(g1, g0 + self.span - 1)])
+                g0 += self.span
+        return [(r[0], r[1]) for r in requests]
+
+    def record(self, product_id, first_day: int, last_day: int, returned_days: np.ndarray, last_final_day: int) -> bool:
+        """Remember the days a successful answer came back without; returns True if any was missing."""
+        last_day = min(last_day, last_final_day)
+        if last_day < first_day:
+            return False
+        got = np.zeros(last_day - first_day + 1, dtype=bool)
+        returned_days = returned_days[(returned_days >= first_day) & (returned_days <= last_day)]
+        got[returned_days - first_day] = True
+        empty_days = np.flatnonzero(~got) + first_day
+        if len(empty_days) == 0:
+            return False
+        self.empty[product_id] = merge_intervals(
+            [tuple(r) for r in self.empty.get(product_id, [])] + runs(empty_days))
+        self.changed = True
+        return True
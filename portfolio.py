@@ -1,26 +1,56 @@
 import datetime
-from typing import List
+import threading
+from collections.abc import Sequence
+from typing import Dict, List
+
+import numpy as np
+
+from tickers import TickerStore, day_index
 
 
 class Product:
-    def __init__(self, base_product, quote_product):
-        self.base = base_product
-        self.quote = quote_product
-        self.id = f"{base_product}-{quote_product}"
+    """A base-quote market, interned: there is a single instance per product id.
 
-    def __str__(self):
-        return self.id
+    Products compare and hash by identity and are numbered in creation order (`index`, an
+    index in `Product.registry` valid in this process only).
+    """
 
-    def __eq__(self, other):
-        if isinstance(other, Product):
-            return self.id == other.id
-        return False
+    __slots__ = ('base', 'quote', 'id', 'index')
 
-    def __hash__(self):
-        return hash(self.id)
+    # every product built so far, by index and by id
+    registry: List['Product'] = []
+    _by_id: Dict[str, 'Product'] = {}
+    _lock = threading.Lock()
+
+    def __new__(cls, base_product, quote_product):
+        product_id = f"{base_product}-{quote_product}"
+        product = cls._by_id.get(product_id)
+        if product is not None:
+            return product
+        with cls._lock:
+            product = cls._by_id.get(product_id)
+            if product is None:
+                product = object.__new__(cls)
+                product.base = base_product
+                product.quote = quote_product
+                product.id = product_id
+                product.index = len(cls.registry)
+                cls.registry.append(product)
+                cls._by_id[product_id] = product
+        return product
+
+    def __reduce__(self):
+        # interned again when unpickled (worker processes, copies)
+        return (Product.build, (self.id,))
+
+    def __str__(self):
+        return self.id
 
     @staticmethod
     def build(product_id) -> 'Product':
+        product = Product._by_id.get(product_id)
+        if product is not None:
+            return product
         tokens = product_id.split('-')
         return Product(tokens[0].strip(), tokens[1].strip())
 
@@ -32,7 +62,18 @@ class Product:
         return res
 
 
-class Order:
+class OrderFormat:
+    __slots__ = ()
+
+    def __str__(self):
+        df = '{0:%d.%m.%Y %H:%M:%S}'.format(self.buy_time)
+        res = f"[{df}] Order {self.buy_currency:.4f} {self.product.base} for {self.buy_price_with_fee:.4f} {self.product.quote} (fee {self.fee:.4f}) | price {self.unit_price:.4f} {self.product.base}/{self.product.quote}"
+        return res
+
+
+class Order(OrderFormat):
+    __slots__ = ('product', 'fee_tax', 'buy_price_with_fee', 'buy_currency', 'fee', 'unit_price', 'buy_time')
+
     def __init__(self, product, fee_tax=0.5):
         self.product = product
         self.fee_tax = fee_tax
@@ -40,6 +81,7 @@ class Order:
         self.buy_currency = 0.0
         self.fee = 0.0
         self.unit_price = 0.0
+        self.buy_time = None
 
     def buy(self, order_date, fund_amount, unit_price):
         self.buy_price_with_fee = fund_amount
@@ -48,28 +90,147 @@ class Order:
         self.unit_price = unit_price
         self.buy_time = order_date
 
-    def __str__(self):
-        df = '{0:%d.%m.%Y %H:%M:%S}'.format(self.buy_time)
-        res = f"[{df}] Order {self.buy_currency:.4f} {self.product.base} for {self.buy_price_with_fee:.4f} {self.product.quote} (fee {self.fee:.4f}) | price {self.unit_price:.4f} {self.product.base}/{self.product.quote}"
-        return res
+
+class OrderLedger:
+    """Orders kept column wise (struct of arrays) in growing numpy arrays."""
+
+    COLUMNS = (('product', np.int32), ('time', 'datetime64[us]'), ('funds', np.float64),
+               ('quantity', np.float64), ('price', np.float64), ('fee', np.float64))
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS}
+
+    def __len__(self):
+        return self.size
+
+    def append(self, product: Product, time: datetime.datetime, funds, quantity, price, fee) -> int:
+        if self.size == len(self.columns['product']):
+            for name in self.columns:
+                self.columns[name] = np.resize(self.columns[name], 2 * self.size)
+        row = self.size
+        columns = self.columns
+        columns['product'][row] = product.index
+        columns['time'][row] = time
+        columns['funds'][row] = funds
+        columns['quantity'][row] = quantity
+        columns['price'][row] = price
+        columns['fee'][row] = fee
+        self.size += 1
+        return row
+
+    def column(self, name) -> np.ndarray:
+        """Values of a column for all the orders (a view, not a copy)."""
+        return self.columns[name][:self.size]
+
+
+class OrderView(OrderFormat):
+    """`Order` api over a ledger row."""
+
+    __slots__ = ('ledger', 'row')
+
+    def __init__(self, ledger: OrderLedger, row: int):
+        self.ledger = ledger
+        self.row = row
+
+    @property
+    def product(self) -> Product:
+        return Product.registry[self.ledger.columns['product'][self.row]]
+
+    @property
+    def buy_time(self) -> datetime.datetime:
+        return self.ledger.columns['time'][self.row].item()
+
+    @property
+    def buy_price_with_fee(self) -> float:
+        return float(self.ledger.columns['funds'][self.row])
+
+    @property
+    def buy_currency(self) -> float:
+        return float(self.ledger.columns['quantity'][self.row])
+
+    @property
+    def unit_price(self) -> float:
+        return float(self.ledger.columns['price'][self.row])
+
+    @property
+    def fee(self) -> float:
+        return float(self.ledger.columns['fee'][self.row])
+
+
+class OrderList(Sequence):
+    """Read only list of the ledger orders, as views created on access."""
+
+    def __init__(self, ledger: OrderLedger):
+        self.ledger = ledger
+
+    def __len__(self):
+        return len(self.ledger)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [OrderView(self.ledger, row) for row in range(*index.indices(len(self.ledger)))]
+        if index < 0:
+            index += len(self.ledger)
+        if index < 0 or index >= len(self.ledger):
+            raise IndexError("order index out of range")
+        return OrderView(self.ledger, index)
+
+
+class Holding:
+    """Running totals of the orders of a single product."""
+
+    __slots__ = ('product', 'quantity', 'spent', 'fees', 'orders', 'first_buy', 'last_buy')
+
+    def __init__(self, product):
+        self.product = product
+        self.quantity = 0.0
+        self.spent = 0.0
+        self.fees = 0.0
+        self.orders = 0
+        self.first_buy = None
+        self.last_buy = None
+
+    def add(self, order: Order):
+        self.buy(order.buy_time, order.buy_price_with_fee, order.buy_currency, order.fee)
+
+    def buy(self, order_date, fund_amount, quantity, fee):
+        self.quantity += quantity
+        self.spent += fund_amount
+        self.fees += fee
+        self.orders += 1
+        if self.first_buy is None or order_date < self.first_buy:
+            self.first_buy = order_date
+        if self.last_buy is None or order_date > self.last_buy:
+            self.last_buy = order_date
 
 
 class Portfolio:
     def __init__(self, base_currency):
-        self.orders = []
-        self.portfolio = {}
+        self.ledger = OrderLedger()
+        self.orders = OrderList(self.ledger)
+        self.holdings: Dict[Product, Holding] = {}
+        self.total_spent = 0.0
         self.base_currency = base_currency
 
     def add(self, order: Order):
-        self.orders.append(order)
-        if order.product not in self.portfolio:
-            self.portfolio[order.product] = 0.0
-        self.portfolio[order.product] += order.buy_currency
+        self.buy(order.product, order.buy_time, order.buy_price_with_fee, order.unit_price, order.fee)
+
+    def buy(self, product: Product, order_date, fund_amount, unit_price, fee=None):
+        """Record an order without building an `Order`, the fee defaults to 0.5% of the funds."""
+        if fee is None:
+            fee = fund_amount * 0.5 / 100.0
+        quantity = fund_amount * unit_price
+        self.ledger.append(product, order_date, fund_amount, quantity, unit_price, fee)
+        if product not in self.holdings:
+            self.holdings[product] = Holding(product)
+        self.holdings[product].buy(order_date, fund_amount, quantity, fee)
+        self.total_spent += fund_amount
 
     def get_total_spent(self):
-        return sum(o.buy_price_with_fee for o in self.orders)
+        return self.total_spent
 
-    def summary(self, prices):
+    def summary(self, prices: TickerStore, live_prices: Dict[str, float] = None):
         v = ""
         v += f"Portfolio contains {len(self.orders)} orders\n"
         for o in self.orders:
@@ -77,21 +238,19 @@ class Portfolio:
             v += "\n"
         v += "Total amounts in portfolio:\n"
 
-        nowts = str(datetime.datetime.now().replace(
-            hour=0, minute=0, second=0, microsecond=0).timestamp())
+        today = day_index(datetime.datetime.now())
         total = 0.0
-        for product in self.portfolio:
-            product_value = self.portfolio[product] * \
-                prices[product.id][nowts]["close"]
-            spent = 0.0
-            for order in self.orders:
-                if order.product == product:
-                    spent += order.buy_price_with_fee
-            v += f"{self.portfolio[product]:.4f} {product.base:<3} \t| spent {spent:.4f} {self.base_currency} \t| current value: {product_value:.4f} {self.base_currency} ({product_value/spent*100.0:.4f}%)\n"
+        for product, holding in self.holdings.items():
+            if live_prices is not None and product.id in live_prices:
+                product_value = holding.quantity * live_prices[product.id]
+            else:
+                product_value = holding.quantity * prices.close(product.id, today)
+            spent = holding.spent
+            v += f"{holding.quantity:.4f} {product.base:<3} \t| spent {spent:.4f} {self.base_currency} \t| current value: {product_value:.4f} {self.base_currency} ({product_value/spent*100.0:.4f}%)\n"
             total += product_value
 
-        self.gain = total/self.get_total_spent()*100.0
+        self.gain = total/self.total_spent*100.0
 
-        v += f"Total spent: {self.get_total_spent():.4f} {self.base_currency} across {len(self.orders)} orders\n"
+        v += f"Total spent: {self.total_spent:.4f} {self.base_currency} across {len(self.orders)} orders\n"
         v += f"Current worth: {total:.4f} {self.base_currency} | {self.gain:.4f} % gain"
         return v
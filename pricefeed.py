@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+COINBASE_WS_URL = "wss://ws-feed.pro.coinbase.com"
+
+
+def create_connection(url, timeout):
+    import websocket
+    return websocket.create_connection(url, timeout=timeout)
+
+
+class PriceFeed:
+    """Latest price of every product, kept up to date from the exchange `ticker` channel in a background thread."""
+
+    def __init__(self, url, product_ids: Iterable[str], max_age=60.0, backoff=1.0, max_backoff=60.0,
+                 connect=create_connection, clock=time.time):
+        self.url = url
+        self.product_ids = list(product_ids)
+        # prices older than this (seconds) are stale, a silent connection is dropped after it too
+        self.max_age = max_age
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect = connect
+        self.clock = clock
+        self.prices: Dict[str, Tuple[float, float]] = {}
+        self.reconnects = 0
+        self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+        self.stopping = threading.Event()
+        self.thread = None
+        self.ws = None
+
+    def start(self):
+        print(f"Subscribing to {len(self.product_ids)} products tickers")
+        self.thread = threading.Thread(
+            target=self.run, name="price-feed", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        ws = self.ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def run(self):
+        delay = self.backoff
+        while not self.stopping.is_set():
+            try:
+                self.ws = self.connect(self.url, self.max_age)
+                self.ws.send(json.dumps({
+                    "type": "subscribe",
+                    "product_ids": self.product_ids,
+                    "channels": ["ticker"],
+                }))
+                while not self.stopping.is_set():
+                    self.on_message(json.loads(self.ws.recv()))
+                    delay = self.backoff
+            except Exception as ex:
+                if self.stopping.is_set():
+                    break
+                print(f"Price feed disconnected ({ex}), reconnecting in {delay:.1f}s")
+                self.reconnects += 1
+            finally:
+                if self.ws is not None:
+                    try:
+                        self.ws.close()
+                    except Exception:
+                        pass
+                    self.ws = None
+            self.stopping.wait(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def on_message(self, msg):
+        if msg.get("type") == "ticker" and "price" in msg:
+            with self.updated:
+                self.prices[msg["product_id"]] = (
+                    float(msg["price"]), self.clock())
+                self.updated.notify_all()
+        elif msg.get("type") == "error":
+            raise RuntimeError(msg.get("message", msg))
+
+    def get_price(self, product_id) -> Optional[float]:
+        """Latest price, None when unknown or stale."""
+        with self.lock:
+            entry = self.prices.get(product_id)
+        if entry is None or self.clock() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    def snapshot(self) -> Dict[str, float]:
+        """All fresh prices."""
+        now = self.clock()
+        with self.lock:
+            return {pid: price for pid, (price, ts) in self.prices.items() if now - ts <= self.max_age}
+
+    def missing(self) -> int:
+        """Products without a fresh price, the lock held."""
+        now = self.clock()
+        return sum(1 for pid in self.product_ids
+                   if pid not in self.prices or now - self.prices[pid][1] > self.max_age)
+
+    def wait_ready(self, timeout) -> bool:
+        """Wait until every product has a fresh price, at most timeout seconds."""
+        deadline = time.monotonic() + timeout
+        with self.updated:
+            while self.missing() > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.updated.wait(remaining)
+        return True
@@ -0,0 +1,67 @@
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from tickers import CLOSE, DAY, FIELDS, HIGH, LOW, OPEN, VOLUME, TickerStore, local_days
+
+
+def parent_indexes(fine: TickerStore, coarse: TickerStore, indexes: np.ndarray) -> np.ndarray:
+    """Coarse bucket of every fine bucket."""
+    if fine.granularity >= DAY:
+        days = indexes * (fine.granularity // DAY)
+    else:
+        days = local_days(indexes * fine.granularity)
+    return days // (coarse.granularity // DAY)
+
+
+def aggregate(indexes: np.ndarray, candles: np.ndarray, parents: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """OHLCV of every parent from its children candles (sorted by index, NaN rows are skipped)."""
+    valid = ~np.isnan(candles[:, CLOSE])
+    candles = candles[valid]
+    parents = parents[valid]
+    if len(parents) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(FIELDS)))
+    keys, starts = np.unique(parents, return_index=True)
+    ends = np.append(starts[1:], len(parents)) - 1
+    rows = np.empty((len(keys), len(FIELDS)))
+    rows[:, LOW] = np.minimum.reduceat(candles[:, LOW], starts)
+    rows[:, HIGH] = np.maximum.reduceat(candles[:, HIGH], starts)
+    rows[:, OPEN] = candles[starts, OPEN]
+    rows[:, CLOSE] = candles[ends, CLOSE]
+    rows[:, VOLUME] = np.add.reduceat(candles[:, VOLUME], starts)
+    return keys, rows
+
+
+class CandlePyramid:
+    """Fine candles (hourly, 15 minutes...) with daily bars aggregated from them locally.
+
+    Coarse levels are refreshed once after new fine candles came in, so daily strategies read
+    the daily level and never go through the fine candles again.
+    """
+
+    def __init__(self, base: TickerStore, granularities: Iterable[int] = (DAY,)):
+        self.base = base
+        self.levels: Dict[int, TickerStore] = {base.granularity: base}
+        for granularity in granularities:
+            if granularity > base.granularity:
+                self.levels[granularity] = TickerStore(granularity)
+
+    def level(self, granularity) -> TickerStore:
+        return self.levels[granularity]
+
+    def refresh(self, product_id, first: int, last: int):
+        """Aggregate again the coarse bars covering the base buckets first..last (inclusive)."""
+        fine = self.base
+        for granularity in sorted(self.levels):
+            if granularity == self.base.granularity:
+                continue
+            coarse = self.levels[granularity]
+            # whole coarse buckets, the edges may hold children outside first..last
+            first_parent, last_parent = parent_indexes(fine, coarse, np.array([first, last]))
+            start = fine.index(coarse.to_datetime(int(first_parent)))
+            end = fine.index(coarse.to_datetime(int(last_parent) + 1)) - 1
+            indexes, candles = fine.range(product_id, start, end)
+            keys, rows = aggregate(indexes, candles, parent_indexes(fine, coarse, indexes))
+            coarse.put(product_id, keys, rows)
+            # the next level is built from this one, not from the base again
+            fine, first, last = coarse, int(first_parent), int(last_parent)
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from metrics import registry
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep, name="default"):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+                self.waited += wait
+            registry.count("ratelimit_sleeps", limiter=self.name)
+            registry.count("ratelimit_sleep_seconds", wait, limiter=self.name)
+            self.sleep(wait)
+
+    def drain(self):
+        # called when the exchange tells us we are too fast, everyone waits for a refill
+        with self.lock:
+            self._refill()
+            self.tokens = 0.0
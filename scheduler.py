@@ -0,0 +1,186 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from filelock import atomic_write
+from metrics import registry
+from portfolio import Product
+
+
+class Profile:
+    """A recurring buy: `amount` every `every` days at `at` (HH:MM, local time)."""
+
+    def __init__(self, name, amount, interval, strategy, limit, every=None, at="12:00"):
+        self.name = name
+        self.amount = amount
+        self.interval = interval
+        self.strategy = strategy
+        self.limit = limit
+        self.every = every if every is not None else interval
+        hour, minute = at.split(":")
+        self.at = timedelta(hours=int(hour), minutes=int(minute))
+
+    def first_slot(self, now: datetime) -> datetime:
+        """First run time not before now."""
+        slot = now.replace(hour=0, minute=0, second=0, microsecond=0) + self.at
+        return slot if slot >= now else slot + timedelta(days=1)
+
+    def due_slot(self, last_slot: Optional[datetime], now: datetime) -> Optional[datetime]:
+        """Most recent slot after last_slot that is due at now, missed older slots are skipped."""
+        if last_slot is None:
+            return None
+        step = timedelta(days=self.every)
+        if now < last_slot + step:
+            return None
+        return last_slot + step * ((now - last_slot) // step)
+
+    def next_slot(self, last_slot: datetime) -> datetime:
+        return last_slot + timedelta(days=self.every)
+
+
+class SchedulerState:
+    """Last slot of every profile and the orders of a run in progress, persisted in a json file.
+
+    Orders are written before being placed, a run interrupted half way is resumed with the same
+    orders and run id after a restart instead of being computed (and bought) again.
+    """
+
+    def __init__(self, path="serve.json"):
+        self.path = path
+        self.profiles: Dict[str, Dict] = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self.profiles = json.loads(f.read())
+
+    def save(self):
+        if self.path is None:
+            return
+        # a crash while saving leaves the previous state, never a truncated file
+        atomic_write(self.path, json.dumps(self.profiles, indent=2))
+
+    def last_slot(self, name) -> Optional[datetime]:
+        entry = self.profiles.get(name)
+        if entry is None or entry.get('slot') is None:
+            return None
+        return datetime.fromisoformat(entry['slot'])
+
+    def set(self, name, slot: datetime, status, run_id=None, orders=None):
+        self.profiles[name] = {'slot': slot.isoformat(), 'status': status,
+                               'run_id': run_id, 'orders': orders}
+        self.save()
+
+
+class Scheduler:
+    """Runs every profile at its slots, keeping the engines (candles, metadata, sessions) warm between runs."""
+
+    def __init__(self, profiles: List[Profile], engine_factory: Callable, state: SchedulerState,
+                 clock=datetime.now, sleep=time.sleep, max_sleep=60, retry_backoff=60, max_retry_backoff=3600,
+                 after_run: Optional[Callable] = None):
+        self.profiles = profiles
+        self.engine_factory = engine_factory
+        self.state = state
+        self.clock = clock
+        self.sleep = sleep
+        # sleeps are chunked so that clock jumps (suspend, ntp) are noticed
+        self.max_sleep = max_sleep
+        # a failed run is retried after retry_backoff seconds, doubled on every failure
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        # profile name -> (failed attempts, time of the next attempt)
+        self.failures: Dict[str, Tuple[int, datetime]] = {}
+        # called after every run attempt, e.g. to write the metrics a daemon is monitored with
+        self.after_run = after_run
+        self.engines = {}
+
+    def engine(self, profile: Profile):
+        if profile.name not in self.engines:
+            # all the profiles read the same candles
+            shared = next(iter(self.engines.values()), None)
+            engine = self.engine_factory(profile, shared)
+            # runs are planned for the scheduler's today, not the wall clock (tests, replays)
+            engine.clock = self.clock
+            self.engines[profile.name] = engine
+        return self.engines[profile.name]
+
+    def run_profile(self, profile: Profile, slot: datetime):
+        entry = self.state.profiles.get(profile.name, {})
+        engine = self.engine(profile)
+        with registry.span("run", profile=profile.name):
+            if entry.get('status') == "started" and entry.get('slot') == slot.isoformat():
+                print(f"Resuming interrupted run {entry['run_id']} of {profile.name} ({slot})")
+                orders = {Product.build(pid): funds for pid, funds in entry['orders'].items()}
+                engine.execute_orders(orders, entry['run_id'], resume=True)
+                self.state.set(profile.name, slot, "done", entry['run_id'], entry['orders'])
+                return
+
+            print(f"**** {profile.name} run of {slot}")
+            orders = engine.plan_run(profile.interval)
+            if orders is None:
+                self.state.set(profile.name, slot, "skipped")
+                return
+            run_id = str(uuid.uuid4())
+            self.state.set(profile.name, slot, "started", run_id,
+                           {p.id: funds for p, funds in orders.items()})
+            engine.execute_orders(orders, run_id)
+            self.state.set(profile.name, slot, "done", run_id,
+                           {p.id: funds for p, funds in orders.items()})
+
+    def run_pending(self) -> int:
+        """Run the profiles due now, returns how many ran."""
+        ran = 0
+        for profile in self.profiles:
+            now = self.clock()
+            if profile.name not in self.state.profiles:
+                # nothing ran yet, the first slot is the next one to come
+                self.state.set(profile.name, profile.first_slot(now) - timedelta(days=profile.every), "scheduled")
+            last_slot = self.state.last_slot(profile.name)
+            if self.state.profiles[profile.name]['status'] == "started":
+                # interrupted, finish it before anything else
+                slot = last_slot
+            else:
+                slot = profile.due_slot(last_slot, now)
+            if slot is None:
+                continue
+            failed = self.failures.get(profile.name)
+            if failed is not None and now < failed[1]:
+                continue
+            try:
+                self.run_profile(profile, slot)
+                ran += 1
+                self.failures.pop(profile.name, None)
+            except Exception as ex:
+                attempts = failed[0] + 1 if failed is not None else 1
+                delay = min(self.retry_backoff * 2 ** (attempts - 1), self.max_retry_backoff)
+                self.failures[profile.name] = (attempts, now + timedelta(seconds=delay))
+                registry.count("serve_failures", profile=profile.name)
+                print(f"Run of {profile.name} at {slot} failed: {ex}, retrying in {delay:.0f}s")
+            if self.after_run is not None:
+                self.after_run()
+        return ran
+
+    def next_run(self) -> datetime:
+        runs = []
+        for profile in self.profiles:
+            next_run = profile.next_slot(self.state.last_slot(profile.name))
+            if profile.name in self.failures:
+                next_run = max(next_run, self.failures[profile.name][1])
+            runs.append(next_run)
+        return min(runs)
+
+    def serve(self, iterations=None):
+        """Run pending profiles then sleep until the next one, forever (or `iterations` times)."""
+        announced = None
+        while iterations is None or iterations > 0:
+            self.run_pending()
+            next_run = self.next_run()
+            if next_run != announced:
+                print(f"Next run at {next_run}")
+                announced = next_run
+            wait = (next_run - self.clock()).total_seconds()
+            if wait > 0:
+                self.sleep(min(wait, self.max_sleep))
+            if iterations is not None:
+                iterations -= 1
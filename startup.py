@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int, int]]:
+    """(module, nesting level, self us, cumulative us) of every `-X importtime` line."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # nested imports are indented by two spaces per level
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        imports.append((name.strip(), level, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def profile_startup(command, exchange_type, top=15) -> str:
+    """Import cost of a trader.py command, measured in a fresh interpreter that doesn't run it."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    code = f"import trader; trader.load_command({command!r}, {exchange_type!r})"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=directory, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Unable to profile startup: {proc.stderr.strip().splitlines()[-1:]}")
+
+    imports = parse_importtime(proc.stderr)
+    total = sum(cumulative for _, level, _, cumulative in imports if level == 0)
+    lines = [f"Startup imports of `{command}` ({exchange_type}): {len(imports)} modules, {total / 1000:.1f} ms",
+             f"{'module':<40} {'self ms':>9} {'cumul ms':>9}"]
+    # submodules imported by a package __init__ show up at the top level, add them to their package
+    packages = {}
+    for name, level, self_us, cumulative_us in imports:
+        if level == 0:
+            package = packages.setdefault(name.split(".")[0], [0, 0])
+            package[0] += self_us
+            package[1] += cumulative_us
+    for name, (self_us, cumulative_us) in sorted(packages.items(), key=lambda p: p[1][1], reverse=True)[:top]:
+        lines.append(f"{name:<40} {self_us / 1000:>9.1f} {cumulative_us / 1000:>9.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules live at the repository root, the synthetic exchange with the benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+import pytest
+
+from backtest import VectorizedBacktest
+from tickers import CLOSE
+from synthetic import SyntheticExchange
+from trading import Strategy, TradingEngine
+
+KEY_DATA = {'type': "synthetic", 'key': "", 'ws_url': "", 'public_rate': 1e9, 'public_burst': 1e9}
+INTERVAL, PERIODS = 7, 20
+
+
+class GappedExchange(SyntheticExchange):
+    """Synthetic candles with some days missing, different ones for every product."""
+
+    def get_historical(self, product_id, begin, end, granularity=86400):
+        rows = super().get_historical(product_id, begin, end, granularity)
+        step = 5 + int(product_id[1:5]) % 4
+        return [row for row in rows if int(row[0]) // 86400 % step != 0]
+
+
+@pytest.fixture(scope="module")
+def prepared(tmp_path_factory):
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("backtest"))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            exchange = GappedExchange(products=12, days=INTERVAL * PERIODS + 10)
+            trading = engine(exchange, Strategy.TopGainers, 3)
+            products = trading.prepare_simulation(INTERVAL, PERIODS)
+    finally:
+        os.chdir(cwd)
+    return exchange, trading.tickers, products
+
+
+def engine(exchange, strategy, limit):
+    trading = TradingEngine(KEY_DATA, "EUR", 50, strategy, limit, exchange=exchange)
+    trading.strategy_file = None
+    return trading
+
+
+@pytest.mark.parametrize("strategy", [Strategy.TopGainers, Strategy.TopLosers, Strategy.TopVolume, Strategy.LessVolume])
+@pytest.mark.parametrize("limit", [0, 3])
+def test_vectorized_backtest_matches_simulate_period(prepared, strategy, limit):
+    exchange, tickers, products = prepared
+    trading = engine(exchange, strategy, limit)
+    trading.tickers = tickers
+    with contextlib.redirect_stdout(io.StringIO()):
+        gain = trading.simulate_period(INTERVAL, PERIODS, products)
+
+    result = VectorizedBacktest(tickers, products, 50).run(strategy, limit, INTERVAL, PERIODS)
+
+    orders = trading.portfolio.orders
+    assert len(orders) == len(result.order_funds) > 0
+    assert [o.product.id for o in orders] == [result.products[p].id for p in result.order_product]
+    assert np.array_equal([o.buy_price_with_fee for o in orders], result.order_funds)
+    assert np.array_equal([o.unit_price for o in orders], result.order_price)
+    assert result.gain == gain
+
+
+def test_candles_have_gaps(prepared):
+    _, tickers, products = prepared
+    close = tickers.matrix([p.id for p in products], min(tickers.days(p.id)[0] for p in products),
+                           max(tickers.days(p.id)[-1] for p in products), 3)
+    assert np.isnan(close).any()
+
+
+def test_unsupported_strategy_is_rejected(prepared):
+    _, tickers, products = prepared
+    with pytest.raises(ValueError):
+        VectorizedBacktest(tickers, products, 50).run(Strategy.Mixed, 3, INTERVAL, PERIODS)
@@ -0,0 +1,80 @@
+import contextlib
+import io
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backtest import buy_time_trends
+from portfolio import Product
+from synthetic import SyntheticExchange
+from tickers import CLOSE, HOUR
+from trading import Strategy, TradingEngine
+
+KEY_DATA = {'type': "synthetic", 'key': "", 'ws_url': "", 'public_rate': 1e9, 'public_burst': 1e9, 'candles': "1h"}
+DAYS = 10
+END = datetime(2024, 3, 10)
+START = END - timedelta(days=7)
+BUY_HOUR = timedelta(hours=10)
+
+
+def hourly(seed, hours):
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0, 0.01, hours)))
+    first = int((END - timedelta(days=DAYS - 1)).timestamp())
+    return np.column_stack([first + np.arange(hours) * HOUR, close * 0.99, close * 1.01, close, close,
+                            rng.lognormal(5, 1, hours)])
+
+
+@pytest.fixture
+def trading():
+    trading = TradingEngine(KEY_DATA, "EUR", 50, Strategy.TopGainers, 2, exchange=SyntheticExchange(products=1))
+    trading.strategy_file = None
+    trading.buy_time = BUY_HOUR
+    products = [Product.build(f"P{i}-EUR") for i in range(5)]
+    for i, product in enumerate(products):
+        candles = hourly(i, DAYS * 24)
+        trading.pyramid.base.update(product.id, candles)
+    return trading, products
+
+
+def rewrite_after(trading, products, when, factor):
+    """Scale every candle from `when` on, a trend known at `when` must not change."""
+    base = trading.pyramid.base
+    for i, product in enumerate(products):
+        indexes, candles = base.range(product.id, base.index(when), base.index(when) + DAYS * 24)
+        candles *= factor ** (i + 1)
+        base.put(product.id, indexes, candles.copy())
+        first, last = base.bounds(product.id)
+        trading.pyramid.refresh(product.id, first, last)
+
+
+def test_trends_use_the_close_known_at_the_buy_time(trading):
+    trading, products = trading
+    base = trading.pyramid.base
+    with contextlib.redirect_stdout(io.StringIO()):
+        trends = trading.get_last_market_trends(products, START, END)
+    for product, gain in trends.items():
+        now = base.close(product.id, base.index(END + BUY_HOUR) - 1)
+        old = base.close(product.id, base.index(START + BUY_HOUR) - 1)
+        assert gain == pytest.approx((now - old) / now * 100.0)
+    assert trading.buy_price(products[0].id, END) == (END + BUY_HOUR, base.close(products[0].id, base.index(END + BUY_HOUR) - 1))
+
+
+@pytest.mark.parametrize("strategy", [Strategy.TopGainers, Strategy.TopLosers, Strategy.TopVolume])
+def test_trends_do_not_read_candles_after_the_buy_time(trading, strategy):
+    trading, products = trading
+    trading.strategy = strategy
+    with contextlib.redirect_stdout(io.StringIO()):
+        trends = trading.get_last_market_trends(products, START, END)
+        gains, volumes = buy_time_trends(trading, products, START, END)
+        price = trading.buy_price(products[0].id, END)
+        daily = trading.tickers.close(products[0].id, trading.tickers.index(END))
+
+        rewrite_after(trading, products, END + BUY_HOUR, 1.5)
+        assert trading.get_last_market_trends(products, START, END) == trends
+        again = buy_time_trends(trading, products, START, END)
+    assert np.array_equal(again[0], gains) and np.array_equal(again[1], volumes)
+    assert trading.buy_price(products[0].id, END) == price
+    # the full day close of END did change, it is only known at the next midnight
+    assert trading.tickers.close(products[0].id, trading.tickers.index(END)) != daily
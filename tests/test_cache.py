@@ -0,0 +1,40 @@
+import json
+from datetime import datetime
+
+from cache import CandleCache
+from tickers import TickerStore, day_index, day_to_datetime
+
+FIRST_DAY = day_index(datetime(2021, 3, 1))
+
+
+def write_legacy(path, product_id="BTC-EUR", days=3):
+    candles = {}
+    for i in range(days):
+        ts = day_to_datetime(FIRST_DAY + i).timestamp()
+        candles[str(ts)] = {'low': 1.0 + i, 'high': 3.0 + i, 'open': 2.0 + i, 'close': 2.5 + i, 'volume': 10.0}
+    with open(path, "w") as f:
+        json.dump({product_id: candles}, f)
+
+
+def test_legacy_cache_is_migrated_next_to_metadata(tmp_path):
+    write_legacy(tmp_path / "cache.json")
+    # the products listing is cached before any candle is read
+    (tmp_path / "cache").mkdir()
+    (tmp_path / "cache" / "metadata.json").write_text(json.dumps({'products': {}}))
+    cache = CandleCache(str(tmp_path / "cache"), str(tmp_path / "cache.json"))
+    store = TickerStore()
+
+    assert cache.load(store, ["BTC-EUR"], FIRST_DAY, FIRST_DAY + 2) == 3
+    assert (tmp_path / "cache" / "BTC-EUR.bin").exists()
+    assert store.close("BTC-EUR", FIRST_DAY + 2) == 4.5
+
+
+def test_legacy_cache_is_migrated_once(tmp_path):
+    write_legacy(tmp_path / "cache.json")
+    CandleCache(str(tmp_path / "cache"), str(tmp_path / "cache.json")).load(
+        TickerStore(), ["BTC-EUR"], FIRST_DAY, FIRST_DAY + 2)
+    write_legacy(tmp_path / "cache.json", "ETH-EUR")
+
+    cache = CandleCache(str(tmp_path / "cache"), str(tmp_path / "cache.json"))
+    assert cache.load(TickerStore(), ["BTC-EUR", "ETH-EUR"], FIRST_DAY, FIRST_DAY + 2) == 3
+    assert not (tmp_path / "cache" / "ETH-EUR.bin").exists()
@@ -0,0 +1,77 @@
+from execution import OrderExecutor
+from portfolio import Product
+from ratelimit import TokenBucket
+from synthetic import SyntheticExchange
+
+BTC, ETH = Product.build("BTC-EUR"), Product.build("ETH-EUR")
+
+
+def executor(exchange, sleeps=None):
+    return OrderExecutor(exchange, TokenBucket(1e9), workers=1, retries=3, backoff=1.0,
+                         sleep=sleeps.append if sleeps is not None else lambda delay: None)
+
+
+def test_transient_errors_are_retried_with_backoff():
+    exchange = SyntheticExchange(products=1, days=1, order_failures=["error", "lost"])
+    sleeps = []
+
+    [result] = executor(exchange, sleeps).execute({BTC: 10.0}, "run")
+
+    assert result.confirmed
+    assert result.attempts == 3
+    assert exchange.orders == 3
+    assert sleeps == [1.0, 2.0]
+
+
+def test_accepted_orders_are_looked_up_before_a_retry():
+    for failure in ("accepted_error", "accepted_timeout"):
+        exchange = SyntheticExchange(products=1, days=1, order_failures=[failure])
+
+        [result] = executor(exchange).execute({BTC: 10.0}, "run")
+
+        assert result.confirmed
+        assert result.order_id == result.client_oid
+        # found by its client_oid, never placed twice
+        assert exchange.orders == 1
+        assert len(exchange.placed) == 1
+
+
+def test_refused_orders_are_not_retried():
+    exchange = SyntheticExchange(products=1, days=1)
+    exchange.place_market_order = lambda product_id, funds, client_oid=None: {'message': "Insufficient funds"}
+
+    [result] = executor(exchange).execute({BTC: 10.0}, "run")
+
+    assert not result.confirmed
+    assert result.attempts == 1
+    assert result.error == "Insufficient funds"
+
+
+def test_unexpected_exceptions_are_not_retried_as_timeouts():
+    exchange = SyntheticExchange(products=1, days=1)
+
+    def broken(product_id, funds, client_oid=None):
+        raise KeyError("id")
+    exchange.place_market_order = broken
+
+    [result] = executor(exchange).execute({BTC: 10.0}, "run")
+
+    assert not result.confirmed
+    assert result.attempts == 1
+    assert "KeyError" in result.error and "timeout" not in result.error
+
+
+def test_resume_only_places_the_missing_orders():
+    exchange = SyntheticExchange(products=1, days=1, order_failures=[None, "error", "error", "error", "error"])
+
+    first = executor(exchange).execute({BTC: 10.0, ETH: 5.0}, "run")
+    assert [r.confirmed for r in first] == [True, False]
+    placed = exchange.orders
+
+    resumed = executor(exchange).execute({BTC: 10.0, ETH: 5.0}, "run", resume=True)
+
+    assert [r.confirmed for r in resumed] == [True, True]
+    assert resumed[0].order_id == first[0].order_id
+    # only the missing order is placed again
+    assert exchange.orders == placed + 1
+    assert len(exchange.placed) == 2
@@ -0,0 +1,94 @@
+import threading
+from datetime import datetime, timedelta
+
+from fetcher import HistoricalFetcher
+from ratelimit import TokenBucket
+from synthetic import SyntheticExchange
+from trading import Strategy, TradingEngine
+
+KEY_DATA = {'type': "synthetic", 'key': "", 'ws_url': "", 'public_rate': 1e9, 'public_burst': 1e9}
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__(1e9)
+        self.drains = 0
+
+    def drain(self):
+        self.drains += 1
+        super().drain()
+
+
+def day_range(exchange, days):
+    return exchange.last - timedelta(days=days - 1), exchange.last + timedelta(hours=23)
+
+
+def test_rate_limited_requests_drain_and_back_off():
+    exchange = SyntheticExchange(products=1, days=30, rate_limited=2)
+    limiter = CountingBucket()
+    sleeps = []
+    fetcher = HistoricalFetcher(exchange, limiter, workers=1, retries=3, backoff=0.5, sleep=sleeps.append)
+
+    candles = fetcher.fetch_one("S0000-EUR", *day_range(exchange, 10))
+
+    assert len(candles) == 10
+    assert exchange.requests == 3
+    assert fetcher.rate_limited == 2
+    assert limiter.drains == 2
+    assert sleeps == [0.5, 1.0]
+
+
+def test_exhausted_retries_return_an_error():
+    exchange = SyntheticExchange(products=1, days=30, rate_limited=10)
+    fetcher = HistoricalFetcher(exchange, TokenBucket(1e9), retries=2, sleep=lambda delay: None)
+
+    response = fetcher.fetch_one("S0000-EUR", *day_range(exchange, 10))
+
+    assert exchange.requests == 3
+    assert isinstance(response, dict) and "rate limit" in response['message'].lower()
+
+
+class BlockingExchange(SyntheticExchange):
+    """Answers S0000 only once released, the other products right away."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release = threading.Event()
+
+    def get_historical(self, product_id, begin, end, granularity=86400):
+        if product_id == "S0000-EUR":
+            assert self.release.wait(5)
+        return super().get_historical(product_id, begin, end, granularity)
+
+
+def test_responses_are_yielded_as_they_arrive():
+    exchange = BlockingExchange(products=3, days=30)
+    fetcher = HistoricalFetcher(exchange, TokenBucket(1e9), workers=3)
+    begin, end = day_range(exchange, 10)
+    results = fetcher.fetch([(pid, begin, end) for pid in exchange.product_ids()])
+
+    # the blocked product doesn't hold back the others
+    first = [next(results)[0][0], next(results)[0][0]]
+    assert sorted(first) == ["S0001-EUR", "S0002-EUR"]
+    exchange.release.set()
+    (product_id, _, _), candles = next(results)
+    assert product_id == "S0000-EUR" and len(candles) == 10
+
+
+def test_prepare_data_merges_rate_limited_fetches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    exchange = SyntheticExchange(products=5, days=60, rate_limited=3)
+    trading = TradingEngine(KEY_DATA, "EUR", 50, Strategy.TopGainers, 3, exchange=exchange)
+    trading.strategy_file = None
+    trading.fetcher.sleep = lambda delay: None
+    products = exchange.get_tradable_products("EUR")
+
+    trading.prepare_data(products, datetime.today() - timedelta(days=20), datetime.today())
+
+    assert trading.fetcher.rate_limited == 3
+    for product in products:
+        indexes, _ = trading.tickers.range(product.id, trading.tickers.index(datetime.today() - timedelta(days=20)),
+                                           trading.tickers.index(datetime.today()))
+        assert len(indexes) == 21
+    # rate limited answers are not remembered as empty ranges
+    assert not (tmp_path / "cache" / "empty.json").exists()
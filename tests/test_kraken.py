@@ -0,0 +1,123 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from exchange import KrakenExchange
+from metadata import is_product_error
+
+DAY0 = int(datetime(2021, 3, 1, tzinfo=timezone.utc).timestamp())
+
+# recorded kraken answers, trimmed to a few pairs
+ASSET_PAIRS = {
+    "XXBTZEUR": {"altname": "XBTEUR", "wsname": "XBT/EUR", "base": "XXBT", "quote": "ZEUR", "pair_decimals": 1,
+                 "cost_decimals": 5, "lot_decimals": 8, "ordermin": "0.0001", "costmin": "0.5", "status": "online"},
+    "XETHZEUR": {"altname": "ETHEUR", "wsname": "ETH/EUR", "base": "XETH", "quote": "ZEUR", "pair_decimals": 2,
+                 "cost_decimals": 5, "lot_decimals": 4, "ordermin": "0.01", "costmin": "0.5", "status": "online"},
+    "XXDGZEUR": {"altname": "XDGEUR", "wsname": "XDG/EUR", "base": "XXDG", "quote": "ZEUR", "pair_decimals": 7,
+                 "cost_decimals": 5, "lot_decimals": 8, "ordermin": "50", "costmin": "0.5", "status": "online"},
+    "XXBTZUSD": {"altname": "XBTUSD", "wsname": "XBT/USD", "base": "XXBT", "quote": "ZUSD", "pair_decimals": 1,
+                 "cost_decimals": 5, "lot_decimals": 8, "ordermin": "0.0001", "costmin": "0.5", "status": "online"},
+    # darkpool pairs have no wsname
+    "XXBTZEUR.d": {"altname": "XBTEUR.d", "base": "XXBT", "quote": "ZEUR", "lot_decimals": 8},
+    "XLTCZEUR": {"altname": "LTCEUR", "wsname": "LTC/EUR", "base": "XLTC", "quote": "ZEUR", "lot_decimals": 8,
+                 "status": "cancel_only"},
+}
+
+
+def ohlc_row(day, close):
+    # [time, open, high, low, close, vwap, volume, count]
+    return [DAY0 + day * 86400, f"{close - 1:.1f}", f"{close + 2:.1f}", f"{close - 3:.1f}", f"{close:.1f}",
+            f"{close:.1f}", f"{100 + day:.8f}", 42]
+
+
+# OHLC pages by `since`, the cursor moves to the last candle of every page
+OHLC_PAGES = {
+    DAY0 - 1: {"XXBTZEUR": [ohlc_row(0, 30000.0), ohlc_row(1, 31000.0)], "last": DAY0 + 86400},
+    DAY0 + 86400: {"XXBTZEUR": [ohlc_row(2, 32000.0)], "last": DAY0 + 2 * 86400},
+    DAY0 + 2 * 86400: {"XXBTZEUR": [], "last": DAY0 + 2 * 86400},
+}
+
+
+class RecordedApi:
+    """krakenex.API replaying recorded answers, keeping the queries made."""
+
+    def __init__(self, tickers=None):
+        self.queries = []
+        self.tickers = tickers or {}
+
+    def query_public(self, method, data=None):
+        self.queries.append((method, data))
+        if method == 'AssetPairs':
+            return {'error': [], 'result': ASSET_PAIRS}
+        if method == 'OHLC':
+            return {'error': [], 'result': OHLC_PAGES[data['since']]}
+        if method == 'Ticker':
+            return {'error': [], 'result': {data['pair']: {'c': [self.tickers[data['pair']], "0.01"]}}}
+        return {'error': [f"EGeneral:Unknown method {method}"]}
+
+    def query_private(self, method, data=None):
+        self.queries.append((method, data))
+        if method == 'AddOrder':
+            return {'error': [], 'result': {'descr': {'order': "buy"}, 'txid': ["OUF4EM-FRGI2-MQMWZD"]}}
+        return {'error': [f"EGeneral:Unknown method {method}"]}
+
+
+def test_markets_map_kraken_pairs_to_products():
+    exchange = KrakenExchange({}, RecordedApi())
+
+    markets = exchange.get_markets(["EUR"])
+
+    products = {p.id: data for p, data in markets["EUR"].items()}
+    assert sorted(products) == ["BTC-EUR", "DOGE-EUR", "ETH-EUR"]
+    assert products["BTC-EUR"]['pair'] == "XXBTZEUR"
+    assert products["BTC-EUR"]['min_market_funds'] == "0.5"
+    assert products["BTC-EUR"]['quote_increment'] == "0.00001"
+    assert products["ETH-EUR"]['lot_decimals'] == 4
+    assert exchange.pair("DOGE-EUR") == "XXDGZEUR"
+
+
+def test_historical_pages_are_joined_in_engine_column_order():
+    api = RecordedApi()
+    exchange = KrakenExchange({}, api)
+    exchange.get_markets(["EUR"])
+
+    candles = exchange.get_historical("BTC-EUR", datetime.fromtimestamp(DAY0),
+                                      datetime.fromtimestamp(DAY0 + 3 * 86400 - 1))
+
+    assert [data['since'] for method, data in api.queries if method == 'OHLC'] == \
+        [DAY0 - 1, DAY0 + 86400, DAY0 + 2 * 86400]
+    assert all(data['pair'] == "XXBTZEUR" and data['interval'] == 1440
+               for method, data in api.queries if method == 'OHLC')
+    # [time, low, high, open, close, volume]
+    assert np.array_equal(candles, [
+        [DAY0, 29997.0, 30002.0, 29999.0, 30000.0, 100.0],
+        [DAY0 + 86400, 30997.0, 31002.0, 30999.0, 31000.0, 101.0],
+        [DAY0 + 2 * 86400, 31997.0, 32002.0, 31999.0, 32000.0, 102.0],
+    ])
+
+
+def test_market_order_volume_is_truncated_to_lot_decimals():
+    api = RecordedApi({"XETHZEUR": "1234.56"})
+    exchange = KrakenExchange({}, api)
+    exchange.get_markets(["EUR"])
+
+    order = exchange.place_market_order("ETH-EUR", 100.0, client_oid="5f3c9a2e-0000-4000-8000-000000000000")
+
+    assert order['id'] == "OUF4EM-FRGI2-MQMWZD"
+    [(_, add_order)] = [q for q in api.queries if q[0] == 'AddOrder']
+    # 100 / 1234.56 = 0.081000..., 4 lot decimals
+    assert add_order['volume'] == "0.0810"
+    assert add_order['pair'] == "XETHZEUR"
+    assert add_order['userref'] == 0x5f3c9a2e
+
+
+def test_market_order_below_ordermin_is_not_sent():
+    api = RecordedApi({"XETHZEUR": "2000.0"})
+    exchange = KrakenExchange({}, api)
+    exchange.get_markets(["EUR"])
+
+    order = exchange.place_market_order("ETH-EUR", 1.0)
+
+    assert 'id' not in order
+    assert is_product_error(order)
+    assert not any(method == 'AddOrder' for method, _ in api.queries)
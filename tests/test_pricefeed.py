@@ -0,0 +1,137 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+
+from pricefeed import PriceFeed
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class StandInServer:
+    """Local websocket server standing in for the exchange ticker feed.
+
+    Every connection gets the next list of messages of `sessions`, then is closed by the server
+    (the last list is replayed forever). The subscriptions received are kept.
+    """
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.subscriptions = []
+        self.connections = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.url = f"ws://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.sock.close()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            session = self.sessions[min(self.connections, len(self.sessions) - 1)]
+            self.connections += 1
+            with conn:
+                try:
+                    self.handshake(conn)
+                    self.subscriptions.append(json.loads(self.recv_frame(conn)))
+                    for msg in session:
+                        self.send_frame(conn, json.dumps(msg))
+                    if session is self.sessions[-1]:
+                        # the last session stays open until the client leaves
+                        self.recv_frame(conn)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def handshake(conn):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += conn.recv(1024)
+        key = next(line.split(":", 1)[1].strip() for line in request.decode().split("\r\n")
+                   if line.lower().startswith("sec-websocket-key"))
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+    @staticmethod
+    def recv_exact(conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise OSError("connection closed")
+            data += chunk
+        return data
+
+    def recv_frame(self, conn) -> str:
+        head = self.recv_exact(conn, 2)
+        size = head[1] & 0x7f
+        if size == 126:
+            size = struct.unpack(">H", self.recv_exact(conn, 2))[0]
+        elif size == 127:
+            size = struct.unpack(">Q", self.recv_exact(conn, 8))[0]
+        # client frames are always masked
+        mask = self.recv_exact(conn, 4)
+        payload = self.recv_exact(conn, size)
+        if head[0] & 0x0f == 0x8:
+            raise OSError("close frame")
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(payload)).decode()
+
+    @staticmethod
+    def send_frame(conn, text):
+        payload = text.encode()
+        if len(payload) < 126:
+            head = struct.pack(">BB", 0x81, len(payload))
+        else:
+            head = struct.pack(">BBH", 0x81, 126, len(payload))
+        conn.sendall(head + payload)
+
+
+def ticker(product_id, price):
+    return {"type": "ticker", "product_id": product_id, "price": str(price)}
+
+
+def test_feed_keeps_latest_prices_and_reconnects():
+    server = StandInServer([
+        [ticker("BTC-EUR", 100.0)],
+        [ticker("BTC-EUR", 101.0), ticker("ETH-EUR", 11.0)],
+    ])
+    feed = PriceFeed(server.url, ["BTC-EUR", "ETH-EUR"], backoff=0.05)
+    feed.start()
+    try:
+        assert feed.wait_ready(5)
+        assert feed.get_price("BTC-EUR") == 101.0
+        assert feed.get_price("ETH-EUR") == 11.0
+        assert feed.snapshot() == {"BTC-EUR": 101.0, "ETH-EUR": 11.0}
+        assert feed.reconnects >= 1
+        assert server.subscriptions[0] == {"type": "subscribe", "product_ids": ["BTC-EUR", "ETH-EUR"],
+                                           "channels": ["ticker"]}
+    finally:
+        feed.stop()
+        server.close()
+
+
+def test_stale_prices_are_not_ready():
+    now = [1000.0]
+    server = StandInServer([[ticker("BTC-EUR", 100.0)]])
+    feed = PriceFeed(server.url, ["BTC-EUR"], max_age=60, backoff=0.05, clock=lambda: now[0])
+    feed.start()
+    try:
+        assert feed.wait_ready(5)
+        # nothing more comes from the server, the price ages
+        now[0] += 61
+        assert feed.get_price("BTC-EUR") is None
+        assert feed.snapshot() == {}
+        assert not feed.wait_ready(0.2)
+    finally:
+        feed.stop()
+        server.close()
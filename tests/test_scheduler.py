@@ -0,0 +1,137 @@
+import contextlib
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler import Profile, Scheduler, SchedulerState
+from synthetic import SyntheticExchange
+from trading import Strategy, TradingEngine
+
+KEY_DATA = {'type': "synthetic", 'key': "", 'ws_url': "", 'public_rate': 1e9, 'public_burst': 1e9,
+            'private_rate': 1e9, 'private_burst': 1e9}
+START = datetime(2021, 3, 1, 11, 0)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def scheduler(exchange, clock, state_file="serve.json", every=7):
+    def engine_factory(profile, shared):
+        trading = TradingEngine(KEY_DATA, "EUR", profile.amount, profile.strategy, profile.limit, exchange=exchange)
+        trading.strategy_file = None
+        trading.executor.sleep = lambda delay: None
+        return trading
+    profile = Profile("default", 50, 7, Strategy.TopGainers, 3, every=every, at="12:00")
+    return Scheduler([profile], engine_factory, SchedulerState(state_file), clock=clock, sleep=clock.sleep,
+                     max_sleep=3600, retry_backoff=60)
+
+
+def serve(sched, iterations):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sched.serve(iterations)
+
+
+def test_slots():
+    profile = Profile("default", 50, 7, Strategy.TopGainers, 3, at="12:00")
+    assert profile.first_slot(START) == datetime(2021, 3, 1, 12, 0)
+    assert profile.first_slot(datetime(2021, 3, 1, 12, 1)) == datetime(2021, 3, 2, 12, 0)
+    last = datetime(2021, 3, 1, 12, 0)
+    assert profile.due_slot(last, last + timedelta(days=6)) is None
+    assert profile.due_slot(last, last + timedelta(days=7)) == datetime(2021, 3, 8, 12, 0)
+    # missed slots are skipped, only the latest one runs
+    assert profile.due_slot(last, last + timedelta(days=22)) == datetime(2021, 3, 22, 12, 0)
+
+
+def test_runs_at_the_slot_with_the_scheduler_clock(workdir):
+    clock = FakeClock(START)
+    # candles end on the fake today, a run planned on the wall clock would find none
+    exchange = SyntheticExchange(products=10, days=60, today=START)
+    sched = scheduler(exchange, clock)
+
+    serve(sched, 2)
+
+    assert clock.sleeps[0] == 3600
+    assert len(exchange.placed) == 3
+    entry = sched.state.profiles["default"]
+    assert entry['status'] == "done" and entry['slot'] == "2021-03-01T12:00:00"
+    assert sched.next_run() == datetime(2021, 3, 8, 12, 0)
+
+
+def test_missed_slots_are_skipped(workdir):
+    clock = FakeClock(START)
+    exchange = SyntheticExchange(products=10, days=60, today=START + timedelta(days=22))
+    serve(scheduler(exchange, clock), 2)
+    placed = len(exchange.placed)
+
+    # down for three weeks, then restarted
+    clock.now = START + timedelta(days=22, hours=2)
+    sched = scheduler(exchange, clock)
+    serve(sched, 1)
+
+    assert len(exchange.placed) == placed + 3
+    assert sched.state.profiles["default"]['slot'] == "2021-03-22T12:00:00"
+
+
+def test_failed_runs_back_off(workdir):
+    clock = FakeClock(START + timedelta(hours=1))
+    exchange = SyntheticExchange(products=10, days=60, today=START)
+    calls = []
+
+    def get_account(base_currency):
+        calls.append(clock.now)
+        if len(calls) < 3:
+            raise ConnectionError("network down")
+        return {'currency': base_currency, 'balance': "1000"}
+    exchange.get_account = get_account
+    sched = scheduler(exchange, clock)
+
+    serve(sched, 3)
+
+    assert calls == [START + timedelta(hours=1), START + timedelta(hours=1, minutes=1),
+                     START + timedelta(hours=1, minutes=3)]
+    assert sched.state.profiles["default"]['status'] == "done"
+    assert len(exchange.placed) == 3
+
+
+def test_interrupted_run_is_resumed_without_buying_twice(workdir):
+    clock = FakeClock(START + timedelta(hours=1))
+    exchange = SyntheticExchange(products=10, days=60, today=START)
+    place = exchange.place_market_order
+
+    def crash_after_first(product_id, quote_amount, client_oid=None):
+        if len(exchange.placed) == 1:
+            raise KeyboardInterrupt()
+        return place(product_id, quote_amount, client_oid)
+    exchange.place_market_order = crash_after_first
+    sched = scheduler(exchange, clock)
+    sched.engine(sched.profiles[0]).executor.workers = 1
+    with pytest.raises(KeyboardInterrupt):
+        serve(sched, 1)
+    started = sched.state.profiles["default"]
+    assert started['status'] == "started" and len(exchange.placed) == 1
+
+    exchange.place_market_order = place
+    restarted = scheduler(exchange, clock)
+    serve(restarted, 1)
+
+    entry = restarted.state.profiles["default"]
+    assert entry['status'] == "done" and entry['run_id'] == started['run_id']
+    assert len(exchange.placed) == 3
+    assert sorted(o['product_id'] for o in exchange.placed.values()) == sorted(started['orders'])
@@ -0,0 +1,240 @@
+import datetime
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# candle columns, same order as the exchange historic rates (minus the time)
+LOW, HIGH, OPEN, CLOSE, VOLUME = range(5)
+FIELDS = ('low', 'high', 'open', 'close', 'volume')
+
+# candle sizes in seconds
+MINUTES_15 = 900
+HOUR = 3600
+DAY = 86400
+WEEK = 7 * DAY
+GRANULARITIES = {"15m": MINUTES_15, "1h": HOUR, "1d": DAY, "1w": WEEK}
+EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+
+def day_index(value) -> int:
+    """Integer day (proleptic ordinal) of a datetime, date or unix timestamp, at local midnight."""
+    if isinstance(value, datetime.datetime):
+        return value.date().toordinal()
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    return datetime.datetime.fromtimestamp(int(float(value))).date().toordinal()
+
+
+def day_to_datetime(day: int) -> datetime.datetime:
+    return datetime.datetime.fromordinal(day)
+
+
+def local_days(timestamps) -> np.ndarray:
+    """`day_index` of many unix timestamps at once."""
+    ts = np.asarray(timestamps, dtype=np.int64)
+    if len(ts) == 0:
+        return np.empty(0, dtype=np.int64)
+    # the utc offset changes a couple of times a year, look it up once per utc day
+    utc_days, inverse = np.unique(ts // DAY, return_inverse=True)
+    first = np.array([_utc_offset(d * DAY) for d in utc_days])
+    last = np.array([_utc_offset(d * DAY + DAY - 1) for d in utc_days])
+    offsets = first[inverse]
+    for i in np.flatnonzero((first != last)[inverse]):
+        offsets[i] = _utc_offset(ts[i])
+    return (ts + offsets) // DAY + EPOCH_DAY
+
+
+def _utc_offset(ts) -> int:
+    return time.localtime(int(ts)).tm_gmtoff
+
+
+class TickerStore:
+    """OHLCV candles stored as one float array per product, indexed by integer bucket.
+
+    Daily (and multiple of a day) buckets follow local midnight, the index of a daily candle is
+    its `day_index`. Intraday buckets are unix time divided by the granularity.
+    """
+
+    def __init__(self, granularity=DAY):
+        self.granularity = granularity
+        self._first: Dict[str, int] = {}
+        self._data: Dict[str, np.ndarray] = {}
+
+    def index(self, value) -> int:
+        """Bucket of a datetime, date or unix timestamp."""
+        if self.granularity >= DAY:
+            return day_index(value) // (self.granularity // DAY)
+        if isinstance(value, datetime.datetime):
+            value = value.timestamp()
+        elif isinstance(value, datetime.date):
+            value = datetime.datetime(value.year, value.month, value.day).timestamp()
+        return int(float(value)) // self.granularity
+
+    def indexes(self, timestamps) -> np.ndarray:
+        if self.granularity >= DAY:
+            return local_days(timestamps) // (self.granularity // DAY)
+        return np.asarray(timestamps, dtype=np.int64) // self.granularity
+
+    def to_datetime(self, index: int) -> datetime.datetime:
+        """Start of the bucket."""
+        if self.granularity >= DAY:
+            return day_to_datetime(index * (self.granularity // DAY))
+        return datetime.datetime.fromtimestamp(index * self.granularity)
+
+    def __contains__(self, product_id):
+        return product_id in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def products(self) -> List[str]:
+        return list(self._data.keys())
+
+    def bounds(self, product_id) -> Tuple[int, int]:
+        """First and last day (inclusive) covered by the product array."""
+        first = self._first[product_id]
+        return first, first + len(self._data[product_id]) - 1
+
+    def _ensure(self, product_id, first_day, last_day):
+        if product_id not in self._data:
+            self._first[product_id] = first_day
+            self._data[product_id] = np.full(
+                (last_day - first_day + 1, len(FIELDS)), np.nan)
+            return
+        first, last = self.bounds(product_id)
+        if first_day >= first and last_day <= last:
+            return
+        new_first = min(first, first_day)
+        new_last = max(last, last_day)
+        data = np.full((new_last - new_first + 1, len(FIELDS)), np.nan)
+        data[first - new_first:last - new_first + 1] = self._data[product_id]
+        self._first[product_id] = new_first
+        self._data[product_id] = data
+
+    def candle(self, product_id, day: int) -> Optional[np.ndarray]:
+        data = self._data.get(product_id)
+        if data is None:
+            return None
+        idx = day - self._first[product_id]
+        if idx < 0 or idx >= len(data) or np.isnan(data[idx, CLOSE]):
+            return None
+        return data[idx]
+
+    def has(self, product_id, day: int) -> bool:
+        return self.candle(product_id, day) is not None
+
+    def get(self, product_id, day: int, field: int) -> Optional[float]:
+        c = self.candle(product_id, day)
+        if c is None:
+            return None
+        return float(c[field])
+
+    def close(self, product_id, day: int) -> Optional[float]:
+        return self.get(product_id, day, CLOSE)
+
+    def volume(self, product_id, day: int) -> Optional[float]:
+        return self.get(product_id, day, VOLUME)
+
+    def range(self, product_id, start_day: int, end_day: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Days and candles (a view, missing days are NaN) between start and end day inclusive."""
+        data = self._data.get(product_id)
+        if data is None:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(FIELDS)))
+        first, last = self.bounds(product_id)
+        start_day = max(start_day, first)
+        end_day = min(end_day, last)
+        if end_day < start_day:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(FIELDS)))
+        return (np.arange(start_day, end_day + 1),
+                data[start_day - first:end_day - first + 1])
+
+    def days(self, product_id) -> np.ndarray:
+        """Days for which the product has a candle."""
+        data = self._data.get(product_id)
+        if data is None:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(~np.isnan(data[:, CLOSE])) + self._first[product_id]
+
+    def set(self, product_id, day: int, values):
+        self._ensure(product_id, day, day)
+        self._data[product_id][day - self._first[product_id]] = values
+
+    def update(self, product_id, tickers: Iterable) -> np.ndarray:
+        """Merge exchange historic rates ([time, low, high, open, close, volume] rows)."""
+        if isinstance(tickers, np.ndarray):
+            # already numeric, no per candle parsing
+            return self.put(product_id, self.indexes(tickers[:, 0]), tickers[:, 1:6].astype(float))
+        days = []
+        rows = []
+        for t in tickers:
+            try:
+                days.append(self.index(int(t[0])))
+                rows.append([float(v) for v in t[1:6]])
+            except:
+                print(f"Failed to parse ticker {t}")
+        return self.put(product_id, np.asarray(days, dtype=np.int64), np.asarray(rows))
+
+    def put(self, product_id, days: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Store candle rows (N x 5) for the given days, returns the days written."""
+        if len(days) == 0:
+            return days
+        self._ensure(product_id, int(days.min()), int(days.max()))
+        self._data[product_id][days - self._first[product_id]] = rows
+        return days
+
+    def matrix(self, product_ids: List[str], first_day: int, last_day: int, field: int = CLOSE) -> np.ndarray:
+        """Products x days matrix of a single field, NaN where there is no candle."""
+        res = np.full((len(product_ids), last_day - first_day + 1), np.nan)
+        for i, pid in enumerate(product_ids):
+            days, candles = self.range(pid, first_day, last_day)
+            if len(days) > 0:
+                res[i, days[0] - first_day:days[-1] - first_day + 1] = candles[:, field]
+        return res
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Legacy `cache.json` layout: product -> str(midnight timestamp) -> candle fields."""
+        res = {}
+        for pid in self._data:
+            res[pid] = {}
+            for day in self.days(pid):
+                ts = str(day_to_datetime(int(day)).timestamp())
+                c = self.candle(pid, int(day))
+                res[pid][ts] = {f: float(c[i]) for i, f in enumerate(FIELDS)}
+        return res
+
+    @staticmethod
+    def from_dict(data: Dict[str, Dict[str, Dict[str, float]]]) -> 'TickerStore':
+        store = TickerStore()
+        for pid, candles in data.items():
+            store.update(pid, [[int(float(ts))] + [c[f] for f in FIELDS]
+                               for ts, c in candles.items()])
+        return store
+
+    def to_shared(self) -> Tuple[shared_memory.SharedMemory, Dict[str, Tuple[int, int, int]]]:
+        """Copy all candles in a shared memory block, returns it with the layout needed to attach it."""
+        rows = sum(len(d) for d in self._data.values())
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(1, rows * len(FIELDS) * 8))
+        block = np.ndarray((rows, len(FIELDS)), dtype=np.float64, buffer=shm.buf)
+        layout = {}
+        offset = 0
+        for pid, data in self._data.items():
+            block[offset:offset + len(data)] = data
+            layout[pid] = (self._first[pid], offset, len(data))
+            offset += len(data)
+        return shm, layout
+
+    @staticmethod
+    def attach(name: str, layout: Dict[str, Tuple[int, int, int]]) -> Tuple['TickerStore', shared_memory.SharedMemory]:
+        """Read-only store over a block created by `to_shared`, the block must be kept referenced."""
+        shm = shared_memory.SharedMemory(name=name)
+        rows = sum(n for _, _, n in layout.values())
+        block = np.ndarray((rows, len(FIELDS)), dtype=np.float64, buffer=shm.buf)
+        store = TickerStore()
+        for pid, (first, offset, n) in layout.items():
+            store._first[pid] = first
+            store._data[pid] = block[offset:offset + n]
+            store._data[pid].flags.writeable = False
+        return store, shm
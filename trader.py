@@ -2,8 +2,9 @@
 """Trader.
 
 Usage:
-  trader.py simulate [--tune] [--amount=<amount>] [--interval=<interval>] [--periods=<periods>] [--strategy=<strategy>] [--limit=<limit>] [--config=<configfile>]
-  trader.py run [--amount=<amount>] [--config=<configfile>] [--interval=<interval>] [--strategy=<strategy>] [--limit=<limit>]
+  trader.py simulate [--profile-startup] [--report=<file>] [--metrics=<file>] [--tune] [--tune-strategies=<strategies>] [--tune-limits=<limits>] [--tune-intervals=<intervals>] [--workers=<workers>] [--sort=<column>] [--engine=<engine>] [--strategies=<strategies>] [--robustness=<runs>] [--offsets=<days>] [--min-periods=<periods>] [--staggered] [--seed=<seed>] [--buy-hour=<hour>] [--currencies=<currencies>] [--amount=<amount>] [--interval=<interval>] [--periods=<periods>] [--strategy=<strategy>] [--limit=<limit>] [--config=<configfile>]
+  trader.py run [--profile-startup] [--report=<file>] [--metrics=<file>] [--currencies=<currencies>] [--amount=<amount>] [--config=<configfile>] [--interval=<interval>] [--strategy=<strategy>] [--limit=<limit>]
+  trader.py serve [--report=<file>] [--metrics=<file>] [--amount=<amount>] [--config=<configfile>] [--interval=<interval>] [--strategy=<strategy>] [--limit=<limit>] [--every=<days>] [--at=<time>] [--state=<file>]
   trader.py (-h | --help)
   trader.py --version
 
@@ -14,20 +15,44 @@ Options:
   --periods=<periods>       How many periods (of interval) [default: 20]
   --strategy=<strategy>     Strategy (gainer|loser|mixed) [default: gainer]
   --config=<configfile>     JSON API config file [default: config.sandbox.json]
-  --amount=<amount>         Amount to buy [default: 50]
+  --amount=<amount>         Amount to buy (in every currency) [default: 50]
+  --currencies=<currencies>  Comma separated quote currencies to buy with [default: EUR]
   --tune                    Generate gains for many different parameters
   --limit=<limit>           Max products to buy, -1 all of them [default: 10]
+  --tune-strategies=<strategies>  Comma separated strategies to tune [default: gainer,loser,mixed]
+  --tune-limits=<limits>          Comma separated limits to tune [default: 2,5,8,10,15]
+  --tune-intervals=<intervals>    Comma separated intervals to tune [default: 3,5,7,10,15,20,30,40]
+  --workers=<workers>       Tune worker processes, 0 for one per core [default: 0]
+  --sort=<column>           Sort tune results by gain|strategy|limit|interval [default: gain]
+  --engine=<engine>         Simulation engine loop|vector, mixed and topmarketcap always use loop [default: loop]
+  --strategies=<strategies>  Simulate these comma separated strategies side by side in a single pass
+  --robustness=<runs>       Simulate the strategy ending at <runs> random offsets before today, report the gain distribution
+  --offsets=<days>          Max offset in days of the robustness runs [default: 365]
+  --min-periods=<periods>   Min periods of the robustness runs, up to --periods (default: --periods)
+  --staggered               Robustness runs over every offset and periods count instead of random ones
+  --seed=<seed>             Random seed of the robustness runs
+  --buy-hour=<hour>         Simulated orders are bought at this hour instead of the daily close, needs intraday `candles` in the config (loop engine)
+  --report=<file>           Write a json report of the phases timings and api calls
+  --metrics=<file>          Write the run metrics in prometheus text format
+  --every=<days>            Days between two serve runs, the interval when not given
+  --at=<time>               Local time (HH:MM) of the serve runs [default: 12:00]
+  --state=<file>            Where serve keeps its schedule and the orders of the run in progress [default: serve.json]
+  --profile-startup         Report the import time of the command modules instead of running it
 """
 
+import contextlib
 import datetime
+import importlib
+import io
 import itertools
 import json
 import sys
+import threading
 
 from docopt import docopt
 
-from gui import (Header, make_footer, make_gain, make_layout, make_order_grid,
-                 make_portfolio, make_summary)
+from exchange import BACKENDS
+from metrics import registry
 from portfolio import Portfolio, Product
 from trading import Strategy, TradingEngine
 
@@ -36,52 +61,122 @@ base_currency = "EUR"
 # buy_amount = 0.0012 # ~ 50 EUR -> BTC
 
 
-def simulate(data, buy_amount, interval, periods, strategy, limit_products, tune=False):
+def load_command(command, exchange_type):
+    """Import the modules the command needs, without running it."""
+    if command == "simulate":
+        import rich.live
+        import rich.console
+        import backtest
+        import gui
+        import tune
+    for module in BACKENDS[exchange_type]:
+        importlib.import_module(module)
+
+
+def simulate(data, buy_amount, interval, periods, strategy, limit_products, tune=False, tune_grid=None, workers=0, sort="gain", engine="loop", buy_hour=None, strategies=None, currencies=None, robustness=None):
+    # the ui is only needed here, `run` doesn't pay for importing it
+    from rich.console import Console
+    from rich.live import Live
+
+    from backtest import VECTORIZED_STRATEGIES, simulate_strategies, simulate_vectorized
+    from gui import SimulationDashboard, make_portfolios_table, make_robustness_table, make_tune_table
+    from tune import robustness_begin, run_robustness, run_tune
+
+    currencies = currencies if currencies is not None else [base_currency]
+
+    def prepared_markets(days, strategy):
+        """Engines of all the currencies and their products, from one listing and one candles fetch."""
+        trading = TradingEngine(data, currencies[0], buy_amount, strategy, limit_products)
+        trading.strategy_file = None
+        if buy_hour is not None:
+            trading.buy_time = datetime.timedelta(hours=buy_hour)
+        engines = [trading] + [trading.for_currency(c) for c in currencies[1:]]
+        today = datetime.datetime.today()
+        return engines, trading.prepare_markets(engines, today - datetime.timedelta(days=days), today)
 
     if tune:
-        limits = [2, 5, 8, 10, 15]
-        intervals = [3, 5, 7, 10, 15, 20, 30, 40]
-        strategies = [Strategy.TopGainers, Strategy.TopLosers, Strategy.Mixed]
-        res = {}
-        for strategy in strategies:
-            res[strategy] = {}
-            for limit in limits:
-                res[strategy][limit] = {}
-                for interval in intervals:
-                    trading = TradingEngine(data, base_currency,
-                                    buy_amount, strategy, limit)
-                    gain = trading.simulate_period(interval, periods)
-                    res[strategy][limit][interval] = gain
-
-        for i in res:
-            print(f"{i}: {res[i]}")
+        tune_strategies, limits, intervals = tune_grid
+        engines, markets = prepared_markets(max(intervals) * periods, tune_strategies[0])
+        for currency_engine in engines:
+            currency = currency_engine.base_currency
+            results = run_tune(data, currency, buy_amount, periods, tune_strategies, limits, intervals, workers, sort,
+                               engine, trading=currency_engine, tradable_products=markets[currency])
+            Console().print(make_tune_table(results, currency))
 
-    else:
-        trading = TradingEngine(data, base_currency,
-                            buy_amount, strategy, limit_products)
-        gain = trading.simulate_period(interval, periods)
+    elif robustness is not None:
+        first = robustness_begin(robustness, interval, datetime.datetime.today())
+        engines, markets = prepared_markets((datetime.datetime.today() - first).days + 1, strategy)
+        for currency_engine in engines:
+            currency = currency_engine.base_currency
+            summary, _ = run_robustness(data, currency, buy_amount, strategy, limit_products, interval, robustness,
+                                        workers, engine, trading=currency_engine, tradable_products=markets[currency])
+            Console().print(make_robustness_table(
+                summary, f"{strategy.name} gains in {currency}, {interval} days interval, {limit_products} products limit"))
+
+    elif strategies is not None:
+        engines, markets = prepared_markets(periods * interval, strategies[0])
+        for currency_engine in engines:
+            portfolios = simulate_strategies(currency_engine, interval, periods, strategies,
+                                             markets[currency_engine.base_currency])
+            Console().print(make_portfolios_table({s.name: p for s, p in portfolios.items()}, currency_engine.tickers,
+                                                  f"Strategies in {currency_engine.base_currency}", "Strategy"))
+        print(f"Across last {periods} periods of {interval} days each, {limit_products} products limit")
 
-        layout = make_layout()
+    elif len(currencies) > 1:
+        trading = TradingEngine(data, currencies[0],
+                                buy_amount, strategy, limit_products)
+        if buy_hour is not None:
+            trading.buy_time = datetime.timedelta(hours=buy_hour)
+        engines = [trading] + [trading.for_currency(c) for c in currencies[1:]]
+        begin = datetime.datetime.today() - datetime.timedelta(days=periods*interval)
+        markets = trading.prepare_markets(engines, begin, datetime.datetime.today())
+        for currency_engine in engines:
+            tradable_products = markets[currency_engine.base_currency]
+            if engine == "vector":
+                simulate_vectorized(currency_engine, interval, periods, tradable_products)
+            else:
+                currency_engine.simulate_period(interval, periods, tradable_products)
+        Console().print(make_portfolios_table({e.base_currency: e.portfolio for e in engines},
+                                              trading.tickers, "Currencies", "Currency"))
+        print(
+            f"Strategy used: {strategy.name} across last {periods} periods of {interval} days each")
 
-        layout["header"].update(Header(periods, interval))
-        layout["orders"].update(make_order_grid(trading.portfolio.orders))
-        layout["summary"].update(make_summary(
-            trading.portfolio, trading.tickers_cache, base_currency))
-        layout["portfoliolayout"].update(make_portfolio(
-            trading.portfolio, trading.tickers_cache))
-        layout["gainlayout"].update(
-            make_gain(trading.portfolio, trading.tickers_cache))
-        layout["footer"].update(make_footer(
-            strategy, buy_amount, base_currency, limit_products))
+    else:
+        trading = TradingEngine(data, currencies[0],
+                            buy_amount, strategy, limit_products)
+        if buy_hour is not None:
+            trading.buy_time = datetime.timedelta(hours=buy_hour)
+        tradable_products = trading.prepare_simulation(interval, periods)
 
-        # print(layout)
-        from time import sleep
+        dashboard = SimulationDashboard(periods, interval, trading.tickers,
+                                        strategy, buy_amount, currencies[0], limit_products)
+        # the dashboard keeps the real stdout, the engine prints are collected and shown once it is closed
+        console = Console(file=sys.stdout)
+        engine_output = io.StringIO()
+        # refreshed only when a period completed, nothing is redrawn while idle
+        with Live(dashboard.layout, console=console, auto_refresh=False, screen=True, redirect_stdout=False) as live, \
+                contextlib.redirect_stdout(engine_output):
+            if engine == "vector" and strategy in VECTORIZED_STRATEGIES:
+                simulate_vectorized(
+                    trading, interval, periods, tradable_products)
+                dashboard.update(trading.portfolio, periods)
+            else:
+                for event in trading.iter_simulate_period(interval, periods, tradable_products):
+                    dashboard.update(trading.portfolio, event.period)
+                    if dashboard.render():
+                        live.refresh()
+            if dashboard.render():
+                live.refresh()
 
-        from rich.live import Live
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                pass
 
-        with Live(layout, refresh_per_second=10, screen=True):
-            while True:
-                sleep(0.5)
+        print(engine_output.getvalue(), end="")
+        print(trading.portfolio.summary(trading.tickers))
+        print(
+            f"Strategy used: {strategy.name} across last {periods} periods of {interval} days each")
 
 
 def strategy_from_option(strategy):
@@ -101,26 +196,122 @@ def strategy_from_option(strategy):
         raise RuntimeError(f"Unknown strategy {strategy}")
 
 
-def run(data, buy_amount, interval, strategy, limit_products):
+def run(data, buy_amount, interval, strategy, limit_products, currencies=None):
+    currencies = currencies if currencies is not None else [base_currency]
     trading = TradingEngine(data,
-                            base_currency, buy_amount, strategy, limit_products)
-    trading.single_run(interval)
+                            currencies[0], buy_amount, strategy, limit_products)
+    if len(currencies) == 1:
+        trading.single_run(interval)
+    else:
+        # one products listing, one candles fetch and one price feed for all the currencies
+        engines = [trading] + [trading.for_currency(c) for c in currencies[1:]]
+        end = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+        markets = trading.prepare_markets(engines, end - datetime.timedelta(days=interval), end)
+        feed = trading.get_price_feed({p: d for m in markets.values() for p, d in m.items()})
+        reports = {}
+        for currency_engine in engines:
+            currency_engine.price_feed = feed
+            with registry.span("run", currency=currency_engine.base_currency):
+                ordering_products = currency_engine.plan_run(interval)
+                if ordering_products is not None:
+                    reports[currency_engine.base_currency] = currency_engine.execute_orders(ordering_products)
+
+        print("\nCurrencies report:")
+        print("-------")
+        for currency in currencies:
+            if currency not in reports:
+                print(f"{currency}: no account")
+                continue
+            results = reports[currency]
+            confirmed = [r for r in results if r.confirmed]
+            print(f"{currency}: {len(confirmed)}/{len(results)} orders confirmed, {sum(r.funds for r in confirmed):.2f} {currency} spent")
 
     print(f"\nStrategy {strategy}")
     print(f"Run finished at {datetime.datetime.now()}")
 
 
+def serve(data, profiles, state_file, report_file=None, metrics_file=None):
+    from scheduler import Scheduler, SchedulerState
+
+    def engine_factory(profile, shared):
+        trading = TradingEngine(data, base_currency, profile.amount,
+                                profile.strategy, profile.limit)
+        if profile.name != "default":
+            trading.strategy_file = f"strategy.{profile.name}.lock"
+        if shared is not None:
+            # one candle store, cache and price feed for all the profiles
+            trading.tickers = shared.tickers
+            trading.pyramid = shared.pyramid
+            trading.cache = shared.cache
+            trading.price_feed = shared.price_feed
+        return trading
+
+    def write_metrics():
+        if report_file or metrics_file:
+            registry.write(report_file, metrics_file)
+
+    scheduler = Scheduler(profiles, engine_factory, SchedulerState(state_file), after_run=write_metrics)
+    try:
+        scheduler.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_profiles(data, arguments):
+    """Profiles of the `schedule` config list, a single one from the command line otherwise."""
+    from scheduler import Profile
+
+    if 'schedule' in data:
+        return [Profile(p['name'], p.get('amount', 50), p.get('interval', 7),
+                        strategy_from_option(p.get('strategy', "gainer")), p.get('limit', 10),
+                        p.get('every'), p.get('at', "12:00")) for p in data['schedule']]
+    return [Profile("default", int(arguments["--amount"]), int(arguments["--interval"]),
+                    strategy_from_option(arguments["--strategy"]), int(arguments["--limit"]),
+                    int(arguments["--every"]) if arguments["--every"] is not None else None,
+                    arguments["--at"])]
+
+
 if __name__ == "__main__":
     arguments = docopt(__doc__, version="1.0")
 
     with open(arguments["--config"]) as config_file:
         data = json.load(config_file)
 
-    if arguments["simulate"]:
-        simulate(data, int(arguments["--amount"]), int(arguments["--interval"]), int(
-            arguments["--periods"]), strategy_from_option(arguments["--strategy"]), int(arguments["--limit"]), bool(arguments["--tune"]))
-    elif arguments["run"]:
-        run(data, int(arguments["--amount"]), int(arguments["--interval"]),
-            strategy_from_option(arguments["--strategy"]), int(arguments["--limit"]))
+    if arguments["--profile-startup"]:
+        from startup import profile_startup
+        print(profile_startup("simulate" if arguments["simulate"] else "run", data['type']))
+    elif arguments["serve"]:
+        try:
+            serve(data, serve_profiles(data, arguments), arguments["--state"],
+                  arguments["--report"], arguments["--metrics"])
+        finally:
+            if arguments["--report"] or arguments["--metrics"]:
+                registry.write(arguments["--report"], arguments["--metrics"])
+    elif arguments["simulate"] or arguments["run"]:
+        try:
+            if arguments["simulate"]:
+                robustness = None
+                if arguments["--robustness"] or arguments["--staggered"]:
+                    from tune import robustness_samples
+                    robustness = robustness_samples(int(arguments["--robustness"] or 0), int(arguments["--offsets"]),
+                                                    int(arguments["--min-periods"] or arguments["--periods"]),
+                                                    int(arguments["--periods"]), bool(arguments["--staggered"]),
+                                                    int(arguments["--seed"]) if arguments["--seed"] is not None else None)
+                tune_grid = ([strategy_from_option(s) for s in arguments["--tune-strategies"].split(",")],
+                             [int(l) for l in arguments["--tune-limits"].split(",")],
+                             [int(i) for i in arguments["--tune-intervals"].split(",")])
+                simulate(data, int(arguments["--amount"]), int(arguments["--interval"]), int(
+                    arguments["--periods"]), strategy_from_option(arguments["--strategy"]), int(arguments["--limit"]), bool(arguments["--tune"]),
+                    tune_grid, int(arguments["--workers"]), arguments["--sort"], arguments["--engine"],
+                    float(arguments["--buy-hour"]) if arguments["--buy-hour"] is not None else None,
+                    [strategy_from_option(s) for s in arguments["--strategies"].split(",")] if arguments["--strategies"] else None,
+                    arguments["--currencies"].split(","), robustness)
+            else:
+                run(data, int(arguments["--amount"]), int(arguments["--interval"]),
+                    strategy_from_option(arguments["--strategy"]), int(arguments["--limit"]),
+                    arguments["--currencies"].split(","))
+        finally:
+            if arguments["--report"] or arguments["--metrics"]:
+                registry.write(arguments["--report"], arguments["--metrics"])
     else:
         raise RuntimeError("Unknown mode")
@@ -1,17 +1,29 @@
 import enum
-import math
 import sys
-import json
 import os
 import random
-import time
 from datetime import datetime, timedelta
 import logging
-import urllib.request
 
+import numpy as np
+
+from allocation import ProductConstraints, allocate
 from portfolio import Order, Portfolio, Product
+from pricefeed import COINBASE_WS_URL, PriceFeed
+from cache import CandleCache
 from exchange import Exchange
-from typing import Dict, List
+from execution import OrderExecutor
+from marketcap import MarketCapSnapshots
+from metadata import build_exchange
+from metrics import registry, traced
+from fetcher import HistoricalFetcher
+from filelock import atomic_write, lock_file
+from planner import FetchPlanner
+from ratelimit import TokenBucket
+from pyramid import CandlePyramid
+from trendindex import TrendIndex
+from tickers import CLOSE, DAY, GRANULARITIES, VOLUME, TickerStore, day_index, day_to_datetime
+from typing import Dict, List, Optional, Tuple
 
 
 class Strategy(enum.Enum):
@@ -23,114 +35,160 @@ class Strategy(enum.Enum):
     Mixed = 5
 
 
-# class PriceTrackerWsClient(cbpro.WebsocketClient):
-#    def start(self, url, products):
-#        self.url = url
-#        self.products = list(products)
-#        self.channels = ['ticker']
-#        self.prices = {}
-#        print(f"Subscribing to {len(self.products)} products tickers")
-#        super().start()
-#
-#    def on_message(self, msg):
-#        if "price" in msg:
-#            self.prices[msg['product_id']] = 1/float(msg['price'])
-#            #print(f"{msg['product_id']}: {self.prices[msg['product_id']]:.5f}")
-#
-#    def on_close(self):
-#        print("-- Goodbye! --")
-#
-#    def get_price(self, product_id):
-#        if product_id in self.prices:
-#            return self.prices[product_id]
-#        else:
-#            return -1
+def next_mixed_strategy(last: Optional[Strategy]) -> Strategy:
+    """Strategy the mixed rotation uses after `last` (TopGainers first)."""
+    if last is None:
+        return Strategy.TopGainers
+    strategy = Strategy.Mixed
+    curr = last.value
+    while strategy == Strategy.Mixed:
+        curr += 1
+        strategy = Strategy(curr % len(Strategy))
+    return strategy
+
+
+class PeriodEvent:
+    def __init__(self, period, periods, start, end, orders: List[Order]):
+        self.period = period
+        self.periods = periods
+        self.start = start
+        self.end = end
+        self.orders = orders
 
 
 class TradingEngine:
-    def __init__(self, key_data, base_currency, buy_amount, strategy, limit_products):
-        self.exchange = Exchange.build(key_data)
+    def __init__(self, key_data, base_currency, buy_amount, strategy, limit_products, exchange: Exchange = None):
+        self.exchange = exchange if exchange is not None else build_exchange(key_data)
+        self.key_data = key_data
+        self.price_feed = None
+        # today for runs and simulations, replaced by the scheduler clock in serve
+        self.clock = datetime.now
         self.base_currency = base_currency
         self.buy_amount = buy_amount
         self.strategy = strategy
         self.portfolio = Portfolio(base_currency)
-        self.tickers_cache = {}
+        # candles are fetched at this granularity, daily bars get aggregated from finer ones
+        self.granularity = GRANULARITIES[key_data.get('candles', "1d")]
+        self.pyramid = None
+        self.tickers = TickerStore()
+        if self.granularity < DAY:
+            self.pyramid = CandlePyramid(TickerStore(self.granularity))
+            self.tickers = self.pyramid.level(DAY)
+        # simulated orders are bought at this time of the day (needs intraday candles), at the daily close when None
+        self.buy_time: Optional[timedelta] = None
+        self.cache = CandleCache(granularity=self.granularity)
+        # coinbase public endpoints allow 3 requests per second, bursts up to 6
+        self.limiter = TokenBucket(key_data.get('public_rate', 3),
+                                   key_data.get('public_burst', 6), name="public")
+        self.fetcher = HistoricalFetcher(
+            self.exchange, self.limiter, key_data.get('fetch_workers', 4))
+        # private endpoints allow 5 requests per second, bursts up to 10
+        self.order_limiter = TokenBucket(key_data.get('private_rate', 5),
+                                         key_data.get('private_burst', 10), name="private")
+        self.executor = OrderExecutor(
+            self.exchange, self.order_limiter, key_data.get('order_workers', 4))
         self.last_strategy_flag = True
         self.limit_products = limit_products
+        # where the mixed strategy rotation is persisted, None keeps it in memory
+        self.strategy_file = "strategy.lock"
+        self.last_strategy = None
+        # market cap rankings of TopMarketCap, recorded by day so that simulations replay them
+        self.marketcaps = MarketCapSnapshots(key_data.get('marketcap_file', "cache/marketcap.json"),
+                                             key_data.get('marketcap_ttl', 3600),
+                                             key_data.get('marketcap_offline', False))
+        # parsed order constraints of the products seen so far
+        self.constraints: Dict[Product, ProductConstraints] = {}
+
+    def for_currency(self, base_currency) -> 'TradingEngine':
+        """Engine buying with another quote currency, sharing the exchange, candles, cache, rate limiters and price feed."""
+        engine = TradingEngine(self.key_data, base_currency, self.buy_amount,
+                               self.strategy, self.limit_products, exchange=self.exchange)
+        for shared in ('tickers', 'pyramid', 'cache', 'limiter', 'fetcher', 'order_limiter', 'executor',
+                       'price_feed', 'marketcaps', 'constraints', 'buy_time', 'clock'):
+            setattr(engine, shared, getattr(self, shared))
+        # every currency keeps its own mixed rotation
+        if self.strategy_file is not None:
+            engine.strategy_file = f"strategy.{base_currency}.lock"
+        else:
+            engine.strategy_file = None
+        return engine
+
+    def prepare_markets(self, engines: List['TradingEngine'], begin, end) -> Dict[str, Dict[Product, Dict]]:
+        """Tradable products of the engines currencies from one listing, with the candles of all of them fetched together."""
+        currencies = [engine.base_currency for engine in engines]
+        if hasattr(self.exchange, "get_markets"):
+            markets = self.exchange.get_markets(currencies)
+        else:
+            markets = {c: self.exchange.get_tradable_products(c) for c in currencies}
+        products = {}
+        for currency in currencies:
+            print(f"Found {len(markets[currency])} tradable {currency} products")
+            products.update(markets[currency])
+        self.prepare_data(products, begin, end)
+        return markets
 
     def get_concrete_strategy(self):
         strategy = Strategy.Mixed
-        if self.strategy == Strategy.Mixed:
-            strategy_file = "strategy.lock"
-            if os.path.exists(strategy_file):
-                try:
-                    with open(strategy_file, "r") as f:
-                        curr = int(f.read().strip())
-                        while strategy == Strategy.Mixed:
-                            curr += 1
-                            strategy = Strategy(curr % len(Strategy))
-                except:
+        if self.strategy == Strategy.Mixed and self.strategy_file is None:
+            strategy = next_mixed_strategy(self.last_strategy)
+            self.last_strategy = strategy
+            return strategy
+        elif self.strategy == Strategy.Mixed:
+            strategy_file = self.strategy_file
+            # concurrent runs sharing the file each move the rotation one step
+            with lock_file(strategy_file):
+                if os.path.exists(strategy_file):
+                    try:
+                        with open(strategy_file, "r") as f:
+                            curr = int(f.read().strip())
+                            while strategy == Strategy.Mixed:
+                                curr += 1
+                                strategy = Strategy(curr % len(Strategy))
+                    except:
+                        strategy = Strategy.TopGainers
+                        print(
+                            f"Unable to parse last strategy, fallback to default {strategy}")
+                else:
                     strategy = Strategy.TopGainers
-                    print(
-                        f"Unable to parse last strategy, fallback to default {strategy}")
-            else:
-                strategy = Strategy.TopGainers
 
-            with open(strategy_file, "w") as f:
-                f.write(str(strategy.value))
+                atomic_write(strategy_file, str(strategy.value))
             return strategy
         else:
             return self.strategy
 
-    def get_last_market_trends(self, tradable_products, start, end):
+    @traced("get_last_market_trends")
+    def get_last_market_trends(self, tradable_products, start, end, live_prices: Dict[str, float] = None):
+        """Trends between start and end, `live_prices` (product id -> price) replace the end close when given."""
         market_trend = {}
 
         local_strategy = self.get_concrete_strategy()
 
         if local_strategy == Strategy.TopMarketCap:
-            supported_currency = {}
-            for _, product in enumerate(tradable_products):
-                supported_currency[product.base.upper()] = product 
-            try:
-                if self.limit_products > 30:
-                    raise RuntimeError("Buying so many products doesnt make much sense")
-                marketcapapi = "https://api.coingecko.com/api/v3/coins/markets?vs_currency=usd&order=market_cap_desc&per_page=30&page=1&sparkline=false"
-                market_trend = {}
-                with urllib.request.urlopen(marketcapapi) as req:
-                    data = json.loads(req.read().decode())
-                    for coin in data:
-                        symbol = coin['symbol'].upper()
-                        if symbol in supported_currency:
-                            # we give all the same value so it buy for all the same amount
-                            market_trend[supported_currency[symbol]] = 1.0
-                            print(f"Market cap {symbol}: {coin['market_cap']} USD")
-                        if self.limit_products > 0 and len(market_trend) >= self.limit_products:
-                            #print(f"Reached limit!")
-                            print()
-                            break
-                return market_trend
-            except Exception as ex:
-                print(f"Failed to retrieve top market capital from coingecko!")
-                print(str(ex))
-                return {}
+            return self.get_market_cap_trends(tradable_products, end)
         else:
             for _, product in enumerate(tradable_products):
                 pid = product.id
-                sts = str(start.timestamp())
-                ets = str(end.timestamp())
+                now = self.trend_candle(pid, end)
+                old = self.trend_candle(pid, start)
 
-                if sts not in self.tickers_cache[pid] or ets not in self.tickers_cache[pid]:
-                    print(
-                        f"Unable to compute trends for {pid}, missing ticker informations {sts}-{ets}")
-                    continue
-
-                now = self.tickers_cache[pid][ets]
-                old = self.tickers_cache[pid][sts]
                 if local_strategy == Strategy.TopVolume or local_strategy == Strategy.LessVolume:
+                    if now is None or old is None:
+                        print(
+                            f"Unable to compute trends for {pid}, missing ticker informations {start.date()}-{end.date()}")
+                        continue
                     market_trend[product] = (
-                        now["volume"]-old["volume"])/now["volume"] * 100.0
+                        now[1]-old[1])/now[1] * 100.0
                 else:
-                    gain = (now["close"]-old["close"])/now["close"] * 100.0
+                    close = None
+                    if live_prices is not None and pid in live_prices:
+                        close = live_prices[pid]
+                    elif now is not None:
+                        close = now[0]
+                    if close is None or old is None:
+                        print(
+                            f"Unable to compute trends for {pid}, missing ticker informations {start.date()}-{end.date()}")
+                        continue
+                    gain = (close-old[0])/close * 100.0
                     market_trend[product] = gain
 
             if local_strategy == Strategy.TopGainers or local_strategy == Strategy.TopVolume:
@@ -146,200 +204,245 @@ class TradingEngine:
             sorted_market_trend = dict(sorted_list)
             return sorted_market_trend
 
+    def trend_candle(self, product_id, day: datetime) -> Optional[Tuple[float, float]]:
+        """Close and volume the trends of the day are computed from, None when missing.
+
+        With a buy time these are the last intraday close known at that time of the day and
+        the volume of the 24 hours before it, not the daily candle that closes only at midnight.
+        """
+        if self.buy_time is None or self.pyramid is None:
+            candle = self.tickers.candle(product_id, day_index(day))
+            return None if candle is None else (candle[CLOSE], candle[VOLUME])
+        base = self.pyramid.base
+        last = base.index(day + self.buy_time) - 1
+        close = base.close(product_id, last)
+        if close is None:
+            return None
+        _, candles = base.range(product_id, last - DAY // base.granularity + 1, last)
+        return close, float(np.nansum(candles[:, VOLUME]))
+
+    def get_market_cap_trends(self, tradable_products, end):
+        """Biggest market caps among the tradable products, all with the same weight."""
+        supported_currency = {}
+        for _, product in enumerate(tradable_products):
+            supported_currency[product.base.upper()] = product 
+        try:
+            if self.limit_products > 30:
+                raise RuntimeError("Buying so many products doesnt make much sense")
+            if day_index(end) < day_index(self.clock()):
+                # simulated period, only the ranking known back then
+                ranking = self.marketcaps.at(day_index(end))
+            else:
+                ranking = self.marketcaps.latest()
+            if ranking is None:
+                print(f"No market cap snapshot recorded up to {end.date()}")
+                return {}
+            market_trend = {}
+            for symbol, market_cap in ranking:
+                if symbol in supported_currency:
+                    # we give all the same value so it buy for all the same amount
+                    market_trend[supported_currency[symbol]] = 1.0
+                    print(f"Market cap {symbol}: {market_cap} USD")
+                if self.limit_products > 0 and len(market_trend) >= self.limit_products:
+                    #print(f"Reached limit!")
+                    print()
+                    break
+            return market_trend
+        except Exception as ex:
+            print(f"Failed to retrieve top market capital!")
+            print(str(ex))
+            return {}
+
+    def trend_index(self, products: List[Product], begin: datetime, end: datetime) -> TrendIndex:
+        """Window gains, volumes and drawdowns of the products between begin and end (days), for any lookback."""
+        return TrendIndex(self.tickers, [p.id for p in products], day_index(begin), day_index(end))
+
+    @traced("get_buy_quotes")
     def get_buy_quotes(self, selected_prods, tradable_products):
-        orders = {}
-        ratio = sum(abs(v) for v in selected_prods.values())
-        top = ()
         for p in selected_prods:
-            val = abs(self.buy_amount *
-                      (selected_prods[p]/ratio * 100.0) / 100.0)
-            if len(top) == 0 or val > top[1]:
-                top = (p, val)
-            orders[p] = val
-            #print(f"orders[{p}]: {orders[p]}")
-
-        while True:
-            untouched = True
-            for p in orders.copy():
-                min_value = float(tradable_products[p]['min_market_funds'])
-                # if we dont reach the min amount we distribute the amount to the next currency
-                if orders[p] < min_value:
-                    keys = list(orders.keys())
-                    idx = keys.index(p) + 1
-                    if idx >= len(keys):
-                        idx = 0
-                    alternative = keys[idx]
-                    orig_value = orders[p]
-                    orders[alternative] += orders[p]
-                    print(
-                        f"{p} too small ({orig_value:.4f} < {min_value:.4f}), adding to next product {alternative} = {orders[alternative]:.4f} (min {float(tradable_products[alternative]['min_market_funds']):.4f})")
-                    orders.pop(p)
-                    untouched = False
-            if untouched:
-                break
-        # print(orders)
-        # lets truncate all orders to the right quote increment
-        for p in orders:
-            orders[p] = self.round_to_increment(
-                orders[p], float(tradable_products[p]["quote_increment"]))
-
-        return orders
-
-    def ticks_contains_date(self, tickers, expected_date):
-        for t in tickers:
-            if type(t[0]) is not int:
-                print(f"Ticker contain string instead of int {t}")
-                continue
-            dt = datetime.fromtimestamp(int(t[0]))
-            dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-            if dt == expected_date:
-                return True
-        return False
-
-    def prepare_data(self, products: List[Product], begin, end):
-        cache_file = "cache.json"
-        if os.path.exists(cache_file) and os.path.getsize(cache_file) > 0:
-            print(f"Reading cache from file")
-            with open(cache_file, "r") as f:
-                self.tickers_cache = json.loads(f.read())
-
-        days = (end.date()-begin.date()).days
-        days_threshold = 280
-        done = False
-        begin = begin.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = end.replace(hour=0, minute=0, second=0, microsecond=0)
-        real_begin = begin
-        real_end = end
+            # parsed again when a refreshed listing changed them, engines live long in serve
+            known = self.constraints.get(p)
+            if known is None or known.source != ProductConstraints.source_of(tradable_products[p]):
+                self.constraints[p] = ProductConstraints.build(tradable_products[p])
 
-        if days > days_threshold:
+        allocation = allocate(selected_prods, self.buy_amount, self.constraints)
+        for p in allocation.dropped:
             print(
-                f"Too many days requested ({days}), splitting historic rates requests")
-
-        while not done:
-            if days > days_threshold:
-                real_end = real_begin + timedelta(days=days_threshold)
-                if real_end > datetime.today():
-                    real_end = datetime.today()
-                    done = True
-            else:
-                done = True
-
-            sleep_interval = 0
-            for product in products:
-                sleep_interval += 1
-                if sleep_interval % 10 == 0:
-                    time.sleep(1)
+                f"{p} too small (min {self.constraints[p].min_funds_value:.4f}), adding to next product")
+        return allocation.orders
 
-                p = product.id
+    @traced("prepare_data")
+    def prepare_data(self, products: List[Product], begin, end):
+        """Candles of the days begin to end (included), at the engine granularity."""
+        store = self.pyramid.base if self.pyramid is not None else self.tickers
+        product_ids = [product.id for product in products]
+        first_day = store.index(day_to_datetime(day_index(begin)))
+        # buckets after the current one can't have candles yet
+        last_day = min(store.index(day_to_datetime(day_index(end) + 1)) - 1,
+                       store.index(self.clock()))
+        with registry.span("cache.load"):
+            loaded = self.cache.load(store, product_ids, first_day, last_day)
+        print(f"Read {loaded} candles from cache")
+
+        # the previous bucket is the last one whose candle can't show up later
+        last_final_day = store.index(self.clock()) - 1
+        planner = FetchPlanner(
+            store, self.cache.load_empty(), self.cache.stale)
+
+        jobs = []
+        for p in product_ids:
+            for d0, d1 in planner.plan(p, first_day, last_day):
+                # until the end of the last day, so that its candle is included whatever the timezone
+                jobs.append((p, store.to_datetime(d0),
+                             store.to_datetime(d1 + 1) - timedelta(seconds=1), self.granularity))
+
+        print(f"Fetching {len(jobs)} historical data ranges")
+        with registry.span("fetch_historical", jobs=len(jobs)):
+            # responses are merged from this thread as soon as they arrive
+            for (p, real_begin, real_end, _), tickers in self.fetcher.fetch(jobs):
                 print(
                     f"Lookup {p} historical data {real_begin.isoformat()}-{real_end.isoformat()}")
+                if tickers is None or isinstance(tickers, dict):
+                    # failed requests are not remembered as empty ranges, they are planned again
+                    print(f"Failed to retrieve historical data for {p}: {tickers}")
+                    continue
 
-                if p not in self.tickers_cache:
-                    #print(f"Product {p} not in self.tickers_cache!")
-                    self.tickers_cache[p] = {}
-                else:
-                    begin_ts = str(real_begin.timestamp())
-                    end_ts = str(real_end.timestamp())
-                    if begin_ts in self.tickers_cache[p] and end_ts in self.tickers_cache[p]:
-                        #print(f"Product {p} already in cache!")
-                        continue
-                    else:
-                        pass
-                        #print(f"Missing timestamps for {p} {begin_ts} - {end_ts}")
-
-                tickers = self.exchange.get_historical(p, real_begin, real_end)
-
-                if not self.ticks_contains_date(tickers, real_begin) or not self.ticks_contains_date(tickers, real_end):
+                days = store.update(p, tickers)
+                with registry.span("cache.append", product=p):
+                    self.cache.append(p, store, days)
+                self.cache.stale.pop(p, None)
+                if planner.record(p, store.index(real_begin), store.index(real_end), days, last_final_day):
                     print(f"Incomplete historical data for {p}")
-                    # print(tickers)
 
-                for t in tickers:
-                    try:
-                        dt = datetime.fromtimestamp(int(t[0]))
-                        dt = dt.replace(hour=0, minute=0,
-                                        second=0, microsecond=0)
-                        timestamp = str(dt.timestamp())
-                        self.tickers_cache[p][timestamp] = {
-                            'low': t[1],
-                            'high': t[2],
-                            'open': t[3],
-                            'close': t[4],
-                            'volume': t[5],
-                        }
-                    except:
-                        print("Failed to parse ticker")
-                        print(tickers)
-
-            # next chunk
-            real_begin = real_end
-            time.sleep(1)
-        with open(cache_file, "w") as f:
-            f.write(json.dumps(self.tickers_cache))
-        # print(cache)
-
-    def round_to_increment(self, value, increment):
-        s = '{:.16f}'.format(increment).split('.')[1]
-        zeros = len(s) - len(s.lstrip('0'))
-        zeros += 1
-        factor = 10.0 ** zeros
-        return math.trunc(value * factor) / factor
-
-    def single_run(self, interval: int):
+        if planner.changed:
+            with registry.span("cache.save_empty"):
+                self.cache.save_empty(planner.empty)
+        if self.pyramid is not None:
+            with registry.span("pyramid.refresh"):
+                for p in product_ids:
+                    self.pyramid.refresh(p, first_day, last_day)
+
+    @traced("run")
+    def single_run(self, interval: int, run_id=None):
+        ordering_products = self.plan_run(interval)
+        if ordering_products is None:
+            sys.exit(0)
+        return self.execute_orders(ordering_products, run_id)
+
+    def plan_run(self, interval: int) -> Optional[Dict[Product, float]]:
+        """Orders of a run, None when there is no account to buy from."""
         coinbase_account = self.exchange.get_account(self.base_currency)
 
         if coinbase_account is None:
             print(
                 f"Couldnt find a coinbase account with the desired currency {self.base_currency}")
-            sys.exit(0)
+            return None
 
         print(
             f"Coinbase account balance {coinbase_account['balance']} {coinbase_account['currency']}")
 
         print(
-            f"**** Executing run {datetime.now()} - {self.buy_amount} {self.base_currency} / {interval} days interval / {self.limit_products} limit")
-        begin = datetime.today() - timedelta(days=interval)
+            f"**** Executing run {self.clock()} - {self.buy_amount} {self.base_currency} / {interval} days interval / {self.limit_products} limit")
+        begin = self.clock() - timedelta(days=interval)
         begin = begin.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = datetime.today()
+        end = self.clock()
         end = end.replace(hour=0, minute=0, second=0, microsecond=0)
 
         tradable_products = self.exchange.get_tradable_products(
             self.base_currency)
         print(f"Found {len(tradable_products)} tradable products")
-        self.prepare_data(tradable_products, begin, end)
-        trends = self.get_last_market_trends(tradable_products, begin, end)
+
+        live_prices = None
+        feed = self.get_price_feed(tradable_products)
+        if feed is not None:
+            if not feed.wait_ready(self.key_data.get('ws_wait', 5)):
+                print("Price feed not ready, missing prices are taken from candles")
+            live_prices = feed.snapshot()
+
+        last_day = end
+        if live_prices is not None and self.strategy in (Strategy.TopGainers, Strategy.TopLosers) \
+                and all(p.id in live_prices for p in tradable_products):
+            # today's close comes from the feed, only past candles are needed
+            last_day = end - timedelta(days=1)
+        self.prepare_data(tradable_products, begin, last_day)
+        trends = self.get_last_market_trends(
+            tradable_products, begin, end, live_prices)
         ordering_products = self.get_buy_quotes(trends, tradable_products)
 
         print("Trends:")
         print("-------")
         for t in trends:
             print(f"{t.id}: {trends[t]:.2f}%")
+        return ordering_products
 
+    def execute_orders(self, ordering_products: Dict[Product, float], run_id=None, resume=False):
         print("\nExecuting orders:")
         print("-------")
         # print(tradable_products)
         for p in ordering_products:
             print(f"Executing {p.id} order {ordering_products[p]} {p.quote}")
-            order = self.exchange.place_market_order(
-                p.id, ordering_products[p])
-            if "id" in order:
-                print(f"Order {order['id']} confirmed!")
-            else:
-                print(f"Failed to execute order: {order}")
-            time.sleep(1)
+        with registry.span("execute_orders", orders=len(ordering_products)):
+            results = self.executor.execute(ordering_products, run_id, resume)
 
-    def simulate_period(self, trading_interval_days: int, periods: int):
-        begin = datetime.today() - timedelta(days=(periods*trading_interval_days))
-
-        self.trading_interval_days = trading_interval_days
+        print("\nOrders report:")
+        print("-------")
+        for result in results:
+            print(result)
+        confirmed = sum(1 for r in results if r.confirmed)
+        print(f"{confirmed}/{len(results)} orders confirmed")
+        if self.price_feed is not None:
+            self.value_orders(results)
+        return results
+
+    def value_orders(self, results):
+        """Value the confirmed orders from the live price feed, no price is read from candles or REST."""
+        bought = Portfolio(self.base_currency)
+        live_prices = {}
+        for result in results:
+            price = self.price_feed.get_price(result.product.id) if result.confirmed else None
+            if price is None:
+                continue
+            live_prices[result.product.id] = price
+            bought.buy(result.product, self.clock(), result.funds, 1.0 / price)
+        if len(bought.holdings) > 0:
+            print("\nBought at live prices:")
+            print("-------")
+            print(bought.summary(self.tickers, live_prices))
+
+    def get_price_feed(self, tradable_products) -> Optional[PriceFeed]:
+        """Started price feed of the tradable products, None when no websocket url is available."""
+        if self.price_feed is not None:
+            return self.price_feed
+        url = self.key_data.get('ws_url')
+        if url is None and self.key_data.get('type') == "coinbase":
+            url = COINBASE_WS_URL
+        if not url:
+            return None
+        self.price_feed = PriceFeed(url, [p.id for p in tradable_products],
+                                    self.key_data.get('ws_max_age', 60))
+        self.price_feed.start()
+        return self.price_feed
+
+    def prepare_simulation(self, trading_interval_days: int, periods: int):
+        begin = self.clock() - timedelta(days=(periods*trading_interval_days))
 
         tradable_products = self.exchange.get_tradable_products(
             self.base_currency)
         print(f"Found {len(tradable_products)} tradable products")
 
-        self.prepare_data(tradable_products, begin, datetime.today())
+        self.prepare_data(tradable_products, begin, self.clock())
+        return tradable_products
+
+    def iter_simulate_period(self, trading_interval_days: int, periods: int, tradable_products, today=None):
+        """Simulate period after period, yielding a PeriodEvent once the orders of each are in the portfolio.
+
+        The last period ends on `today` (now when None).
+        """
+        self.trading_interval_days = trading_interval_days
+        today = today if today is not None else self.clock()
 
         for p in range(periods, 0, -1):
-            start = datetime.now() - timedelta(days=p*trading_interval_days)
+            start = today - timedelta(days=p*trading_interval_days)
             start = start.replace(hour=0, minute=0, second=0, microsecond=0)
             end = start + timedelta(days=trading_interval_days)
             end = end.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -350,16 +453,39 @@ class TradingEngine:
             ordering_products = self.get_buy_quotes(trends, tradable_products)
             # print(ordering_products)
 
+            orders = []
             for product in ordering_products:
                 pid = product.id
                 order = Order(product)
                 # ticker information contains value for a unit of cryptocurrency
-                unit_value = 1.0 / \
-                    self.tickers_cache[pid][str(end.timestamp())]["close"]
-                order.buy(end, ordering_products[product], unit_value)
+                buy_date, price = self.buy_price(pid, end)
+                order.buy(buy_date, ordering_products[product], 1.0 / price)
                 self.portfolio.add(order)
-
-        print(self.portfolio.summary(self.tickers_cache))
+                orders.append(order)
+
+            yield PeriodEvent(periods - p + 1, periods, start, end, orders)
+
+    def buy_price(self, product_id, day: datetime):
+        """Date and price a simulated order of the day is bought at."""
+        if self.buy_time is not None and self.pyramid is not None:
+            when = day + self.buy_time
+            # the candle starting at `when` closes later, the order gets the last known close
+            price = self.pyramid.base.close(product_id, self.pyramid.base.index(when) - 1)
+            if price is not None:
+                return when, price
+        return day, self.tickers.close(product_id, day_index(day))
+
+    @traced("simulate_period")
+    def simulate_period(self, trading_interval_days: int, periods: int, tradable_products=None):
+        # when products are given their candles are expected to be already in self.tickers
+        if tradable_products is None:
+            tradable_products = self.prepare_simulation(
+                trading_interval_days, periods)
+
+        for _ in self.iter_simulate_period(trading_interval_days, periods, tradable_products):
+            pass
+
+        print(self.portfolio.summary(self.tickers))
         print(
             f"Strategy used: {self.strategy.name} across last {periods} periods of {trading_interval_days} days each")
         return self.portfolio.gain
@@ -0,0 +1,105 @@
+from typing import Dict, List
+
+import numpy as np
+
+from tickers import CLOSE, HIGH, LOW, VOLUME, TickerStore
+
+
+class TrendIndex:
+    """Window statistics of many products over a range of candles, each one O(1) for all products.
+
+    Built once from a TickerStore between the `first` and `last` indexes (days for a daily store),
+    every method takes the window bounds (inclusive) as store indexes and returns one value per
+    product, in `product_ids` order, NaN when the window candles are missing:
+    - gain / volume change between two candles, like `get_last_market_trends`
+    - log return, from the prefix sums of the log returns (gaps are carried over)
+    - traded volume, from the prefix sums of the volumes
+    - highest high / lowest low, from sparse tables built on first use
+    - drawdown of the last close from the window high
+    """
+
+    def __init__(self, tickers: TickerStore, product_ids: List[str], first: int, last: int):
+        self.product_ids = product_ids
+        self.first = first
+        self.last = last
+        self.tickers = tickers
+        self.close = tickers.matrix(product_ids, first, last, CLOSE)
+        self.volumes = tickers.matrix(product_ids, first, last, VOLUME)
+
+        # log returns prefix sums, telescoped: the log of the latest close up to each candle
+        log_close = np.log(self.close)
+        seen = np.where(np.isnan(log_close), 0, np.arange(log_close.shape[1]))
+        np.maximum.accumulate(seen, axis=1, out=seen)
+        self.log_prefix = np.take_along_axis(log_close, seen, axis=1)
+
+        # volume prefix sums (and candle counts), column i covers the candles before i
+        valid = ~np.isnan(self.volumes)
+        self.volume_prefix = np.zeros((len(product_ids), self.close.shape[1] + 1))
+        np.cumsum(np.where(valid, self.volumes, 0.0), axis=1, out=self.volume_prefix[:, 1:])
+        self.count_prefix = np.zeros(self.volume_prefix.shape, dtype=np.int64)
+        np.cumsum(valid, axis=1, out=self.count_prefix[:, 1:])
+
+        # field -> levels of range max/min, level k covers 2^k candles
+        self.tables: Dict[int, List[np.ndarray]] = {}
+
+    def column(self, index: int) -> int:
+        if index < self.first or index > self.last:
+            raise IndexError(f"{index} outside of the indexed range {self.first}-{self.last}")
+        return int(index - self.first)
+
+    def gain(self, start: int, end: int) -> np.ndarray:
+        """Close change from start to end, in percent of the end close."""
+        old, now = self.close[:, self.column(start)], self.close[:, self.column(end)]
+        return (now - old) / now * 100.0
+
+    def volume_change(self, start: int, end: int) -> np.ndarray:
+        """Volume change from start to end, in percent of the end volume."""
+        old, now = self.volumes[:, self.column(start)], self.volumes[:, self.column(end)]
+        return (now - old) / now * 100.0
+
+    def log_return(self, start: int, end: int) -> np.ndarray:
+        return self.log_prefix[:, self.column(end)] - self.log_prefix[:, self.column(start)]
+
+    def volume(self, start: int, end: int) -> np.ndarray:
+        """Volume traded from start to end."""
+        return self.volume_prefix[:, self.column(end) + 1] - self.volume_prefix[:, self.column(start)]
+
+    def mean_volume(self, start: int, end: int) -> np.ndarray:
+        s, e = self.column(start), self.column(end) + 1
+        counts = self.count_prefix[:, e] - self.count_prefix[:, s]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, (self.volume_prefix[:, e] - self.volume_prefix[:, s]) / counts, np.nan)
+
+    def table(self, field: int) -> List[np.ndarray]:
+        if field not in self.tables:
+            values = self.tickers.matrix(self.product_ids, self.first, self.last, field)
+            op, missing = (np.maximum, -np.inf) if field == HIGH else (np.minimum, np.inf)
+            levels = [np.where(np.isnan(values), missing, values)]
+            width = 1
+            while width * 2 <= values.shape[1]:
+                previous = levels[-1]
+                levels.append(op(previous[:, :-width], previous[:, width:]))
+                width *= 2
+            self.tables[field] = levels
+        return self.tables[field]
+
+    def extreme(self, field: int, start: int, end: int) -> np.ndarray:
+        s, e = self.column(start), self.column(end)
+        level = (e - s + 1).bit_length() - 1
+        table = self.table(field)[level]
+        op = np.maximum if field == HIGH else np.minimum
+        res = op(table[:, s], table[:, e - (1 << level) + 1])
+        return np.where(np.isinf(res), np.nan, res)
+
+    def high(self, start: int, end: int) -> np.ndarray:
+        """Highest high from start to end."""
+        return self.extreme(HIGH, start, end)
+
+    def low(self, start: int, end: int) -> np.ndarray:
+        """Lowest low from start to end."""
+        return self.extreme(LOW, start, end)
+
+    def drawdown(self, start: int, end: int) -> np.ndarray:
+        """How far the end close is below the highest high from start to end, in percent (<= 0)."""
+        high = self.high(start, end)
+        return (self.close[:, self.column(end)] - high) / high * 100.0
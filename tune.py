@@ -0,0 +1,193 @@
+import itertools
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from backtest import VECTORIZED_STRATEGIES, VectorizedBacktest
+from metadata import build_exchange
+from tickers import TickerStore, day_index
+from trading import Strategy, TradingEngine
+
+# per worker process state, set once by the pool initializer
+_worker = {}
+
+
+def _init_worker(data, base_currency, shm_name, layout, tradable_products):
+    # simulations are chatty, only the parent reports
+    sys.stdout = open(os.devnull, "w")
+    tickers, shm = TickerStore.attach(shm_name, layout)
+    _worker['data'] = data
+    _worker['base_currency'] = base_currency
+    _worker['exchange'] = build_exchange(data)
+    _worker['tickers'] = tickers
+    _worker['shm'] = shm
+    _worker['tradable_products'] = tradable_products
+
+
+def _simulate(strategy, limit, interval, periods, buy_amount, engine):
+    if engine == "vector" and strategy in VECTORIZED_STRATEGIES:
+        result = VectorizedBacktest(_worker['tickers'], _worker['tradable_products'], buy_amount).run(
+            strategy, limit, interval, periods)
+        return {
+            'strategy': strategy.name,
+            'limit': limit,
+            'interval': interval,
+            'orders': len(result.order_funds),
+            'spent': result.spent,
+            'gain': result.gain,
+        }
+
+    trading = TradingEngine(_worker['data'], _worker['base_currency'],
+                            buy_amount, strategy, limit, exchange=_worker['exchange'])
+    trading.tickers = _worker['tickers']
+    trading.strategy_file = None
+    gain = trading.simulate_period(
+        interval, periods, _worker['tradable_products'])
+    return {
+        'strategy': strategy.name,
+        'limit': limit,
+        'interval': interval,
+        'orders': len(trading.portfolio.orders),
+        'spent': trading.portfolio.get_total_spent(),
+        'gain': gain,
+    }
+
+
+@contextmanager
+def _shared_pool(data, base_currency, trading, tradable_products, workers):
+    """Process pool whose workers read the engine candles from shared memory."""
+    shm, layout = trading.tickers.to_shared()
+    try:
+        with ProcessPoolExecutor(max_workers=workers if workers > 0 else None, initializer=_init_worker,
+                                 initargs=(data, base_currency, shm.name, layout, tradable_products)) as pool:
+            yield pool
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _prepare(data, base_currency, buy_amount, strategy, limit, begin, trading, tradable_products):
+    """Engine and products to simulate, the candles fetched unless the caller already prepared them."""
+    if trading is None:
+        trading = TradingEngine(data, base_currency, buy_amount, strategy, limit)
+    if tradable_products is None:
+        tradable_products = trading.exchange.get_tradable_products(base_currency)
+        print(f"Found {len(tradable_products)} tradable products")
+        trading.prepare_data(tradable_products, begin, datetime.today())
+    return trading, tradable_products
+
+
+def run_tune(data, base_currency, buy_amount, periods, strategies: List[Strategy], limits: List[int], intervals: List[int], workers=0, sort="gain", engine="loop",
+             trading=None, tradable_products=None) -> List[Dict]:
+    """Simulate every strategy/limit/interval combination over a process pool sharing the candles.
+
+    `trading` and `tradable_products` are an engine whose candles are already prepared (e.g. for
+    several currencies at once by `prepare_markets`) and the products of base_currency in it.
+    """
+    begin = datetime.today() - timedelta(days=max(intervals) * periods)
+    trading, tradable_products = _prepare(data, base_currency, buy_amount, strategies[0], limits[0],
+                                          begin, trading, tradable_products)
+
+    combinations = list(itertools.product(strategies, limits, intervals))
+    print(f"Simulating {len(combinations)} combinations")
+    with _shared_pool(data, base_currency, trading, tradable_products, workers) as pool:
+        futures = [pool.submit(_simulate, strategy, limit, interval, periods, buy_amount, engine)
+                   for strategy, limit, interval in combinations]
+        results = [f.result() for f in futures]
+
+    return sorted(results, key=lambda r: r[sort], reverse=sort == "gain")
+
+
+def _robustness_runs(strategy, limit, interval, samples, buy_amount, engine, today, first_day) -> List[Dict]:
+    """Simulations ending `offset` days before today over `periods` periods, for every (offset, periods) sample."""
+    results = []
+    if engine == "vector" and strategy in VECTORIZED_STRATEGIES:
+        if _worker.get('backtest', (None,))[0] != buy_amount:
+            backtest = VectorizedBacktest(_worker['tickers'], _worker['tradable_products'], buy_amount)
+            backtest.preload(first_day, day_index(today))
+            _worker['backtest'] = (buy_amount, backtest)
+        backtest = _worker['backtest'][1]
+        for offset, periods in samples:
+            result = backtest.run(strategy, limit, interval, periods, today - timedelta(days=offset))
+            results.append({'offset': offset, 'periods': periods, 'orders': len(result.order_funds),
+                            'spent': result.spent, 'gain': result.gain if result.spent > 0 else float("nan")})
+        return results
+
+    tickers = _worker['tickers']
+    for offset, periods in samples:
+        end = today - timedelta(days=offset)
+        trading = TradingEngine(_worker['data'], _worker['base_currency'],
+                                buy_amount, strategy, limit, exchange=_worker['exchange'])
+        trading.tickers = tickers
+        trading.strategy_file = None
+        for _ in trading.iter_simulate_period(interval, periods, _worker['tradable_products'], end):
+            pass
+        # worth when the last period ends, not today
+        worth = sum(h.quantity * (tickers.close(p.id, day_index(end)) or float("nan"))
+                    for p, h in trading.portfolio.holdings.items())
+        spent = trading.portfolio.get_total_spent()
+        results.append({'offset': offset, 'periods': periods, 'orders': len(trading.portfolio.orders),
+                        'spent': spent, 'gain': worth / spent * 100.0 if spent > 0 else float("nan")})
+    return results
+
+
+def robustness_samples(runs, max_offset, min_periods, max_periods, staggered=False, seed=None) -> List[Tuple[int, int]]:
+    """(offset days, periods) of every run: random ones, or every offset/periods pair when staggered."""
+    if staggered:
+        return list(itertools.product(range(max_offset + 1), range(min_periods, max_periods + 1)))
+    rng = random.Random(seed)
+    return [(rng.randint(0, max_offset), rng.randint(min_periods, max_periods)) for _ in range(runs)]
+
+
+def summarize_gains(results: List[Dict]) -> Dict:
+    """Distribution of the final gains, runs without orders or prices are only counted."""
+    gains = np.array([r['gain'] for r in results], dtype=float)
+    valid = gains[~np.isnan(gains)]
+    summary = {'runs': len(results), 'skipped': int(len(gains) - len(valid))}
+    if len(valid) == 0:
+        return summary
+    summary.update({
+        'mean': float(valid.mean()),
+        'std': float(valid.std()),
+        'worst': float(valid.min()),
+        'best': float(valid.max()),
+        'losing': float((valid < 100.0).mean() * 100.0),
+    })
+    for q in (5, 25, 50, 75, 95):
+        summary[f"p{q}"] = float(np.percentile(valid, q))
+    return summary
+
+
+def robustness_begin(samples: List[Tuple[int, int]], interval, today: datetime) -> datetime:
+    """First day the robustness samples read."""
+    return today - timedelta(days=max(o for o, _ in samples) + max(p for _, p in samples) * interval)
+
+
+def run_robustness(data, base_currency, buy_amount, strategy: Strategy, limit, interval, samples: List[Tuple[int, int]],
+                   workers=0, engine="loop", chunk=None, trading=None, tradable_products=None) -> Tuple[Dict, List[Dict]]:
+    """Simulate the strategy ending at many offsets before today, over a process pool sharing the candles.
+
+    Returns the gain distribution and the results of every run. `trading` and `tradable_products`
+    are prepared candles and products, like for `run_tune`.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    begin = robustness_begin(samples, interval, today)
+    trading, tradable_products = _prepare(data, base_currency, buy_amount, strategy, limit,
+                                          begin, trading, tradable_products)
+
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    # a few chunks per worker, single runs are too short to be worth a task each
+    chunk = chunk if chunk is not None else max(1, len(samples) // (workers * 4))
+    print(f"Simulating {len(samples)} runs")
+    with _shared_pool(data, base_currency, trading, tradable_products, workers) as pool:
+        futures = [pool.submit(_robustness_runs, strategy, limit, interval, samples[i:i + chunk],
+                               buy_amount, engine, today, day_index(begin))
+                   for i in range(0, len(samples), chunk)]
+        results = [r for f in futures for r in f.result()]
+    return summarize_gains(results), results